@@ -6,31 +6,68 @@
 # ---------peppan_out (contains the PEPPAN.PEPPAN.GFF file)
 # The output of this script is a list of genes that can be matched to a reference genome multifasta to extract a multifasta file of core genes.
 #This script was only used for the single species core genes, as it requires a reference genome to run on.
+# The species folders and their reference strain IDs come from species_registry.json, the species are processed in parallel.
 
-import re
 import os
 from os import path
 import sys
 import fnmatch
 import collections
-
-# Function to check if the line is for reference_species and extract old locus tag
-def extract_old_locus_tag_for_species(line):
-    old_tag_match = re.search(r"old_locus_tag=([^;\n:]+)", line)
-    return old_tag_match.group(1) if old_tag_match else None
-
-species_folder_names = ["Agalactiae", "Iniae", "All", "Equi", "Pneumo", "Suis", "Uberis"]
-species_to_reference_strain_id = { "Agalactiae": "Agal_01173",
-                    "Equi": "Equi_4047", 
-                    "Iniae": "Iniae_GCF_000300915", 
-                    "Pneumo": "Pneumo_TIGR4", 
-                    "Suis": "Suis_P17", 
-                    "Uberis": "Uberis_0140J",
-                    "All": "Uberis_0140J"
-                    }
-
-for species in species_folder_names:
-    print(f'Processing species {species} and mapping peppan and reference locus tags...')
+import argparse
+from multiprocessing import Pool
+# the modules shared by the chapters are in shared/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import gene_catalog, peppan_gff, species_registry
+from shared.locus_tag_index import LocusTagIndex
+
+def map_reference_locus_tags(gff_file_path, reference_strain_ids):
+    """Streams a PEPPAN GFF once and builds the new (peppan) <-> old locus tag index for every reference strain at the same time.
+    Returns {reference_strain_id: LocusTagIndex}; adding a reference strain costs no extra pass over the file."""
+    reference_strain_ids = tuple(dict.fromkeys(reference_strain_ids))
+    mappings = {reference_strain_id: LocusTagIndex() for reference_strain_id in reference_strain_ids}
+    with open(gff_file_path, 'r') as gff_file:
+        for line in gff_file:
+            # Only pick lines starting with a reference_strain_id (e.g Equi_4047)
+            if not line.startswith(reference_strain_ids):
+                continue
+            # Does the line have a peppan locustag?
+            attributes = peppan_gff.parse_attributes(line)
+            if attributes is None:
+                continue
+            _, new_tags, old_tag = attributes
+            if not new_tags:
+                continue
+            for reference_strain_id in reference_strain_ids:
+                if line.startswith(reference_strain_id):
+                    # Create an entry in the lookup table for each peppan locus tag (old_locus_tag can either exist or not)
+                    for new_tag in new_tags:
+                        mappings[reference_strain_id].add(new_tag, old_tag)
+    return mappings
+
+def get_locus_tag_index_path(gff_file_path, reference_strain_id):
+    """The cached index for a reference strain sits next to the PEPPAN GFF it was built from."""
+    return path.join(path.dirname(gff_file_path), f"{reference_strain_id}_locus_tag_index.tsv")
+
+def get_reference_locus_tag_index(gff_file_path, reference_strain_id, reference_strain_ids):
+    """Loads the cached locus tag index for a reference strain, or builds the indexes of every reference strain from one pass over the GFF
+    and caches those of the strains found in it."""
+    index = LocusTagIndex.load_if_fresh(get_locus_tag_index_path(gff_file_path, reference_strain_id), gff_file_path)
+    if index is not None:
+        return index
+    mappings = map_reference_locus_tags(gff_file_path, reference_strain_ids)
+    for strain_id, strain_index in mappings.items():
+        # The registry lists the reference strains of every species, most of them are not in this GFF
+        if not strain_index:
+            continue
+        index_file = get_locus_tag_index_path(gff_file_path, strain_id)
+        try:
+            strain_index.save(index_file)
+        except OSError as error:
+            sys.stderr.write(f"Could not save locus tag index {index_file} ({error}), it is rebuilt on the next run.\n")
+    return mappings[reference_strain_id]
+
+def get_species_paths(species):
+    """Checks the species folder holds the peppan output and the gene_categoriser.R output, and returns the input and output paths."""
     # input paths
     species_folder = path.join(path.curdir, species)
     if not path.exists(species_folder):
@@ -49,85 +86,114 @@ for species in species_folder_names:
     if not core_peppan_gene_locuses_file_name:
         sys.exit("Did you forget to run the R code to generate the output?")
 
-    core_peppan_gene_locuses_file_path = path.join(species_folder, core_peppan_gene_locuses_file_name)
-
-    # Path to the .gff file
-    peppan_gff_file_path = path.join(peppan_folder, "PEPPAN.PEPPAN.gff")
-
-    # Paths for the output .txt files
-    output_reference_tags_file_path = path.join(species_folder, 'core_' + species + '_locus_tags.txt')
-    output_peppan_tags_not_found_file_path = path.join(species_folder, "peppan_locus_tags_not_found.txt")
-    output_duplicate_tags_file_path = path.join(species_folder, "duplicate_tags_found.txt")
-
-
-    # Mapping of new locus tags to old locus tags for the specified species
-    species_specific_mapping = {}
-    with open(peppan_gff_file_path, 'r') as gff_file:
-        for line in gff_file:
-            # Only pick lines starting with reference_strain_id (e.g Equi_4047)
-            if line.startswith(species_to_reference_strain_id[species]):
-                # Does the line have a peppan locustag?
-
-                ortholog_group_content = re.search(r"ortholog_group:([^;]+)", line)
-                if ortholog_group_content:
-                    # Step 2: Split the content by ',GCF_' to handle multiple entries
-                    # Prepend 'GCF_' to each split part except the first one to restore the cut-off part
-                    entries = ['GCF_' + entry if i != 0 else entry for i, entry in enumerate(ortholog_group_content.group(1).split(',GCF_'))]
-
-                    # Step 3: Extract the "RS tag" from each segment
-                    new_tag_matches = [re.search(r":([^:]+):", entry).group(1) for entry in entries if re.search(r":([^:]+):", entry)]
-
-                    # Create an entry in the species specific lookup table if we have a peppan locus tag (old_locus_tag can either exist or not)
-                    for new_tag_match in new_tag_matches:
-                        old_tag = extract_old_locus_tag_for_species(line)
-                        new_tag = new_tag_match
-                        species_specific_mapping[new_tag] = old_tag
-
-    print(f'Entries in species_specific_mapping (Full data dictionary): {len(species_specific_mapping)}')
+    return {
+        "core_peppan_gene_locuses": path.join(species_folder, core_peppan_gene_locuses_file_name),
+        # Path to the .gff file
+        "peppan_gff": path.join(peppan_folder, "PEPPAN.PEPPAN.gff"),
+        # Paths for the output .txt files
+        "output_reference_tags": path.join(species_folder, 'core_' + species + '_locus_tags.txt'),
+        "output_peppan_tags_not_found": path.join(species_folder, "peppan_locus_tags_not_found.txt"),
+        "output_duplicate_tags": path.join(species_folder, "duplicate_tags_found.txt"),
+    }
+
+def map_core_gene_tags(job):
+    """Process pool entry point: maps one species' core peppan locus tags to old locus tags and writes its output files.
+    Returns the log lines, so the parent prints each species' log in one piece."""
+    species, paths, reference_strain_id, reference_strain_ids, catalog = job
+    log = [f'Processing species {species} and mapping peppan and reference locus tags...']
+    core_peppan_gene_locuses_file_path = paths["core_peppan_gene_locuses"]
+    peppan_gff_file_path = paths["peppan_gff"]
+
+    # Mapping of new locus tags to old locus tags for the specified species, built for every reference strain in one pass over the GFF
+    # and cached next to it, so a GFF shared between species folders (or an unchanged one on a rerun) is not read again
+    # Each worker opens its own catalog connection, sqlite connections cannot be shared between processes
+    conn = gene_catalog.connect(catalog) if catalog else None
+    if conn:
+        species_specific_mapping = gene_catalog.get_locus_tag_index(conn, peppan_gff_file_path, reference_strain_id)
+    else:
+        species_specific_mapping = get_reference_locus_tag_index(path.realpath(peppan_gff_file_path), reference_strain_id, reference_strain_ids)
+
+    log.append(f'Entries in species_specific_mapping (Full data dictionary): {len(species_specific_mapping)}')
 
     # Map the core genes (new locus tags) to old locus tags for the specified species
-    with open(core_peppan_gene_locuses_file_path, 'r') as core_peppan_gene_locuses_file:
-         # Strip quotes and newline characters
-        file_content = [line.strip('"\n') for line in core_peppan_gene_locuses_file.readlines()]
-
-        # List of dictionary values (old_locus_tag) for peppan locus tag keys found in dictionary
-        core_genes_species_old_tags = [species_specific_mapping.get(locus_tag) for locus_tag in file_content if locus_tag in species_specific_mapping]
-
-        # List of dictionary values (old_locus_tag) without None values
-        core_genes_old_tags_values = [tag for tag in core_genes_species_old_tags if tag]
-
-        duplicate_core_genes_old_tags_values = [duplicate for duplicate, count in collections.Counter(core_genes_old_tags_values).items() if count > 1]
-
-        duplicate_core_genes_old_tags = {}
-        for duplicate_locus_tag in duplicate_core_genes_old_tags_values:
-            keys = [key for key, v in species_specific_mapping.items() if v == duplicate_locus_tag]
-            duplicate_core_genes_old_tags[duplicate_locus_tag] = keys
-            
-        unique_core_genes_old_tags = set(core_genes_old_tags_values)
-
-        # List of peppan locus tag keys for which dictionary has no value for that key
-        new_tags_not_found = [gene for gene in file_content if species_specific_mapping.get(gene) is None]
+    if conn:
+        file_content = gene_catalog.get_category_tags(conn, core_peppan_gene_locuses_file_path)
+        conn.close()
+    else:
+        with open(core_peppan_gene_locuses_file_path, 'r') as core_peppan_gene_locuses_file:
+            # Strip quotes and newline characters
+            file_content = [line.strip('"\n') for line in core_peppan_gene_locuses_file.readlines()]
+
+    # List of dictionary values (old_locus_tag) for peppan locus tag keys found in dictionary
+    core_genes_species_old_tags = [species_specific_mapping.old_tag(locus_tag) for locus_tag in file_content if locus_tag in species_specific_mapping]
+
+    # List of dictionary values (old_locus_tag) without None values
+    core_genes_old_tags_values = [tag for tag in core_genes_species_old_tags if tag]
+
+    duplicate_core_genes_old_tags_values = [duplicate for duplicate, count in collections.Counter(core_genes_old_tags_values).items() if count > 1]
+
+    duplicate_core_genes_old_tags = {}
+    if duplicate_core_genes_old_tags_values:
+        # Position of every peppan tag in the GFF, so the duplicates are listed in GFF order as before the index existed
+        gff_positions = {new_tag: position for position, new_tag in enumerate(species_specific_mapping.old_by_new)}
+    for duplicate_locus_tag in duplicate_core_genes_old_tags_values:
+        # Every peppan tag sharing this old locus tag, straight from the reverse side of the index
+        duplicate_core_genes_old_tags[duplicate_locus_tag] = sorted(species_specific_mapping.new_tags(duplicate_locus_tag), key=gff_positions.get)
+        
+    unique_core_genes_old_tags = set(core_genes_old_tags_values)
+
+    # List of peppan locus tag keys for which dictionary has no value for that key
+    new_tags_not_found = [gene for gene in file_content if species_specific_mapping.old_tag(gene) is None]
             
     # Count and a sample of unique old locus tags
-    print(f'Number of lines in core_peppan_gene_locuses_txt: {len(file_content)}')
-    print(f'Entries in core_genes_species_old_tags: {len(core_genes_species_old_tags)}')
-    print(f'Number of duplicate old_locus_tags: {len(duplicate_core_genes_old_tags_values)}')
-    print(f'Entries in new_tags_not_found: {len(new_tags_not_found)}')
-    print(f'Entries in unique_core_genes_old_tags: {len(unique_core_genes_old_tags)}')
+    log.append(f'Number of lines in core_peppan_gene_locuses_txt: {len(file_content)}')
+    log.append(f'Entries in core_genes_species_old_tags: {len(core_genes_species_old_tags)}')
+    log.append(f'Number of duplicate old_locus_tags: {len(duplicate_core_genes_old_tags_values)}')
+    log.append(f'Entries in new_tags_not_found: {len(new_tags_not_found)}')
+    log.append(f'Entries in unique_core_genes_old_tags: {len(unique_core_genes_old_tags)}')
     
     # Writing the old locus tags that are present to a file
-    with open(output_reference_tags_file_path, 'w') as file:
+    with open(paths["output_reference_tags"], 'w') as file:
         for tag in unique_core_genes_old_tags:
             file.write(f'{tag}\n')
 
-    with open(output_peppan_tags_not_found_file_path, 'w') as file:
+    with open(paths["output_peppan_tags_not_found"], 'w') as file:
         for tag in new_tags_not_found:
             file.write(f'{tag}\n')
 
-    with open(output_duplicate_tags_file_path, 'w') as file:
+    with open(paths["output_duplicate_tags"], 'w') as file:
         for seq_value, duplicate_keys in duplicate_core_genes_old_tags.items():
             file.write(f'{seq_value}\t')
             for duplicate_key in duplicate_keys:
                 file.write(f'{duplicate_key}\t')
             file.write("\n")
-    print("\n")
+    log.append("\n")
+    return log
+
+def main():
+    parser = argparse.ArgumentParser(description="Map the core peppan locus tags of each species to the old locus tags of its reference strain.")
+    parser.add_argument("-c", "--catalog", help="Read the PEPPAN GFFs and core gene lists from this gene catalog (shared/gene_catalog.py) instead of the files, ingesting a file first if it is new or has changed.")
+    parser.add_argument("-t", "--threads", type=int, help="Number of species processed in parallel (default: one per CPU).")
+    species_registry.add_registry_argument(parser)
+    args = parser.parse_args()
+
+    # species folder name -> reference strain ID, for every species and pangenome folder in the registry
+    species_to_reference_strain_id = species_registry.get_reference_strain_ids(species_registry.load_registry(args.registry))
+
+    # Every folder is checked before any work starts, so a missing input stops the run straight away
+    jobs = [(species, get_species_paths(species), reference_strain_id, list(species_to_reference_strain_id.values()), args.catalog)
+            for species, reference_strain_id in species_to_reference_strain_id.items()]
+
+    workers = species_registry.get_workers(args.threads, len(jobs))
+    if workers > 1:
+        with Pool(workers) as pool:
+            # imap keeps registry order, so each species' log is printed as soon as it and the ones before it are done
+            logs = pool.imap(map_core_gene_tags, jobs)
+            for log in logs:
+                print("\n".join(log))
+    else:
+        for log in map(map_core_gene_tags, jobs):
+            print("\n".join(log))
+
+if __name__ == "__main__":
+    main()
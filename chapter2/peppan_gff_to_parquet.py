@@ -0,0 +1,114 @@
+# The input for this script is a PEPPAN.PEPPAN.gff file (the peppan_out output folder).
+# The output is a single Parquet table with one row per PEPPAN locus tag of every strain in the GFF:
+# strain, peppan_tag, ortholog_group, old_locus_tag, seqid, start, end, strand
+# Unlike generate_unique_core_gene_tags.py, which only keeps the reference strain lines, this keeps the full ortholog_group table.
+# The GFF is split on line boundaries into byte ranges that are parsed on several processes, the ranges are written to the table in file order.
+# Requires pyarrow.
+
+import argparse
+import mmap
+import os
+import sys
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# the modules shared by the chapters are in shared/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import peppan_gff
+
+SCHEMA = pa.schema([
+    ("strain", pa.string()),
+    ("peppan_tag", pa.string()),
+    ("ortholog_group", pa.string()),
+    ("old_locus_tag", pa.string()),
+    ("seqid", pa.string()),
+    ("start", pa.int64()),
+    ("end", pa.int64()),
+    ("strand", pa.string()),
+])
+
+def get_chunks(gff_file, chunk_size):
+    """Splits the file into (start, end) byte ranges of about chunk_size bytes, each moved forward to the start of a line."""
+    size = os.path.getsize(gff_file)
+    if size == 0:
+        return []
+    with open(gff_file, "rb") as fh:
+        data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        bounds = [0]
+        pos = chunk_size
+        while pos < size:
+            line_end = data.find(b"\n", pos - 1)
+            if line_end == -1:
+                break
+            if line_end + 1 > bounds[-1]:
+                bounds.append(line_end + 1)
+            pos = bounds[-1] + chunk_size
+        data.close()
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def parse_chunk(job):
+    """Process pool entry point: parses the GFF lines in one byte range into a pyarrow table.
+    Every locus tag in a line's ortholog_group gets its own row, sharing the line's strain, old locus tag and coordinates."""
+    gff_file, start, end = job
+    with open(gff_file, "rb") as fh:
+        fh.seek(start)
+        text = fh.read(end - start).decode()
+    columns = {name: [] for name in SCHEMA.names}
+    for line in text.splitlines():
+        # Comments, the ##FASTA section and lines without a peppan locus tag are skipped
+        parsed = peppan_gff.parse_line(line)
+        if parsed is None:
+            continue
+        strain, new_tags, ortholog_group, old_tag, seqid, start, end, strand = parsed
+        for new_tag in new_tags:
+            columns["strain"].append(strain)
+            columns["peppan_tag"].append(new_tag)
+            columns["ortholog_group"].append(ortholog_group)
+            columns["old_locus_tag"].append(old_tag)
+            columns["seqid"].append(seqid)
+            columns["start"].append(start)
+            columns["end"].append(end)
+            columns["strand"].append(strand)
+    return pa.table(columns, schema=SCHEMA)
+
+def gff_to_parquet(gff_file, output_file, threads=1, chunk_size=64 * 1024 * 1024):
+    """Parses the GFF in byte ranges on threads processes and streams the ranges into one Parquet file. Returns the number of rows written."""
+    jobs = iter([(gff_file, start, end) for start, end in get_chunks(gff_file, chunk_size)])
+    rows = 0
+    with pq.ParquetWriter(output_file, SCHEMA) as writer:
+        if threads > 1:
+            with Pool(threads) as pool:
+                # At most threads * 2 ranges are parsed or waiting to be written, collected in file order
+                pending = deque(pool.apply_async(parse_chunk, (job,)) for job in islice(jobs, threads * 2))
+                while pending:
+                    table = pending.popleft().get()
+                    for job in islice(jobs, 1):
+                        pending.append(pool.apply_async(parse_chunk, (job,)))
+                    writer.write_table(table)
+                    rows += table.num_rows
+        else:
+            for table in map(parse_chunk, jobs):
+                writer.write_table(table)
+                rows += table.num_rows
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a PEPPAN.PEPPAN.gff into a Parquet table of every strain's PEPPAN locus tags, ortholog groups, old locus tags and coordinates.")
+    parser.add_argument("-g", "--gff", required=True, help="Path to the PEPPAN.PEPPAN.gff file.")
+    parser.add_argument("-o", "--output", help="Path to the output Parquet file (default: the GFF path with a .parquet extension).")
+    parser.add_argument("-t", "--threads", type=int, default=1, help="Number of worker processes parsing the GFF (default: 1).")
+    parser.add_argument("-c", "--chunk-size", type=int, default=64, help="Size in MiB of the byte ranges the GFF is split into (default: 64).")
+    args = parser.parse_args()
+
+    output_file = args.output or os.path.splitext(args.gff)[0] + ".parquet"
+    rows = gff_to_parquet(args.gff, output_file, args.threads, args.chunk_size * 1024 * 1024)
+    print(f"{rows} PEPPAN locus tags written to {output_file}")
+
+if __name__ == "__main__":
+    main()
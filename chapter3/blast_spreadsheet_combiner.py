@@ -1,12 +1,17 @@
-# input are a chosen species name + all the $speciesname_essentials_vs_speciesnameessentialdb.xlsx spreadsheets generated by blast_to_spreadsheet.py. There should be 5, one for each species you are comparing your chosen species against, make sure to comment out the chosent species down below
-# output is a master spreadsheet for that species "$speciesname_combined.xlsx" 
+# input are a chosen species name + all the $speciesname_essentials_vs_speciesnameessentialdb tables (.parquet, .feather or .xlsx) generated by blast_to_spreadsheet.py. There should be one for each other species in species_registry.json, the chosen species itself is skipped
+# output is a master table for that species, e.g. "$speciesname_combined.parquet", its format following the extension of the output file (see shared/table_io.py)
 # used to create the input for spreadsheet_blast_combined_analysis.py
 
 
 
 import pandas as pd
+import os
 import sys
 import argparse
+from multiprocessing import Pool
+# the modules shared by the chapters are in shared/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import species_registry, table_io
 
 def get_args():
     try:
@@ -14,7 +19,9 @@ def get_args():
             description="Generates an xlsx spreadsheet from a given blast result file"
         )
         parser.add_argument("-s", "--species", required=True, action="store", help="The species name to generate a master spreadsheet for")
-        parser.add_argument("-o","--outfile", action="store", required=True, help="Output file to the master spreadsheet in.")
+        parser.add_argument("-o","--outfile", action="store", required=True, help="Output file to the master table in (.parquet, .feather or .xlsx).")
+        parser.add_argument("-t", "--threads", type=int, action="store", help="Number of spreadsheets read in parallel (default: one per CPU).")
+        species_registry.add_registry_argument(parser)
         if len(sys.argv) == 1:
             parser.print_help(sys.stderr)
             sys.exit(1)
@@ -27,6 +34,18 @@ def get_args():
 
     return parser.parse_args()
 
+def read_database_spreadsheet(table_path):
+    """Process pool entry point: reads one blast table and labels its rows with the database name taken from the file name."""
+    # Read the table into a DataFrame
+    temp_df = table_io.read_table(table_path)
+
+    # Determine the database name from the file name
+    database_name = os.path.splitext(table_path.split('_vs_')[1])[0]
+
+    # Add the database name as a new column to the DataFrame
+    temp_df['Database'] = database_name
+    return temp_df
+
 def main():
     args = get_args()
 
@@ -38,38 +57,35 @@ def main():
     ])
 
     species_name = args.species
-    excel_paths = [
-        f'{species_name}_essential_vs_iniaeessentialdb.xlsx',
-        f'{species_name}_essential_vs_pneumoessentialdb.xlsx',
-        f'{species_name}_essential_vs_suisessentialdb.xlsx',
-        #f'{species_name}_essential_vs_uberisessentialdb.xlsx', ############################################# MAKE SURE TO COMMENT OUT THE ONE THAT CORRESPONDS TO THE SPECIES YOU CHOSE TO RUN, NO POINT IN COMPARING A SPECIES ESSENTIAL GENES TO ITSELF
-        f'{species_name}_essential_vs_agalessentialdb.xlsx',
-        f'{species_name}_essential_vs_equiessentialdb.xlsx'
-    ]
-
-    # Process each file and concatenate the data into the combined DataFrame
-    for excel_path in excel_paths:
-        # Read the Excel file into a DataFrame
-        temp_df = pd.read_excel(excel_path)
-        
-        # Determine the database name from the file name
-        database_name = excel_path.split('_vs_')[1].replace('.xlsx', '')
-        
-        # Add the database name as a new column to the DataFrame
-        temp_df['Database'] = database_name
-        
+    species_keys = species_registry.get_species_keys(species_registry.load_registry(args.registry))
+    # No point in comparing a species essential genes to itself, so the chosen species is left out
+    stems = [f'{species_name}_essential_vs_{species}essentialdb' for species in species_keys if species != species_name]
+    table_paths = [table_io.find_table(stem) for stem in stems]
+    missing = [stem for stem, path in zip(stems, table_paths) if path is None]
+    if missing:
+        sys.exit(f"No .parquet, .feather or .xlsx table found for {', '.join(missing)}")
+
+    # Read the files in parallel, keeping their order
+    workers = species_registry.get_workers(args.threads, len(table_paths))
+    if workers > 1:
+        with Pool(workers) as pool:
+            temp_dfs = pool.map(read_database_spreadsheet, table_paths)
+    else:
+        temp_dfs = list(map(read_database_spreadsheet, table_paths))
+
+    # Concatenate the data into the combined DataFrame
+    for temp_df in temp_dfs:
         # Combine with the main DataFrame
         combined_df = pd.concat([combined_df if not combined_df.empty else None, temp_df])
 
-    # Replace NaN values with empty strings
-    combined_df.fillna('', inplace=True)
+    # Missing values are left as NA, typed columns cannot hold '' and Excel shows NA as an empty cell anyway
 
     # Reset index in the combined DataFrame
     combined_df.reset_index(drop=True, inplace=True)
 
-    # Save the combined DataFrame to a new Excel file
-    combined_excel_path = args.outfile
-    combined_df.to_excel(combined_excel_path, index=False)
+    # Save the combined DataFrame to a new table
+    combined_table_path = args.outfile
+    table_io.write_table(combined_df, combined_table_path)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
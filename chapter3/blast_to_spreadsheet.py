@@ -1,24 +1,74 @@
 # this scripts inputs are the blast run result files in .txt or .html format
-# the outputs are a spreadsheet with the same fields
+# the outputs are a table with the same fields, Parquet by default (--format feather or xlsx for the other formats, see shared/table_io.py)
 # this script was used to generate spreadsheets from blast results as they are easier to manipulate
+# the results are streamed line by line into typed columns (Int32 lengths and coordinates, float64 evalues) by shared/blast_results.py, and every query row records its '# N hits found' count
+# files can be given as a comma separated list of files, folders (every .txt file in them) and glob patterns, and are converted on --workers processes
+# files whose output is newer than the blast result and was written with the same options are skipped unless --force is given
+# the options of every output are recorded in a <table>.json sidecar next to it
+# --top-k keeps only the best hits of each query and --min-qcov/--min-identity drop weak hits while the file is read, so the table never holds the rest
 
-import pandas as pd
+import os
+import json
+import time
+from glob import glob
+from multiprocessing import Pool
 import sys
 import argparse
-
-fields = ['query id', 'subject id', 'alignment length', 'query length', 'subject length', 'q. start', 'q. end', 's. start', 's. end', 'evalue']
+# the modules shared by the chapters are in shared/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import gene_catalog, table_io
+from shared.blast_results import process_blast_results
 
 def get_args():
     try:
         parser = argparse.ArgumentParser(
-            description="Generates an xlsx spreadsheet from a given blast result file"
+            description="Generates a table (Parquet by default, or Feather or xlsx) from given blast result files"
         )
         parser.add_argument(
             "-f",
             "--file",
             action="store",
-            help="The filename or filenames comma separated",
+            help="The filename or filenames comma separated. Folders (every .txt file in them) and quoted glob patterns (e.g. '*_essentialdb.txt') are expanded",
+        )
+        parser.add_argument(
+            "-w",
+            "--workers",
+            type=int,
+            default=1,
+            action="store",
+            help="Number of files converted in parallel (default: 1)",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Convert every file, even those whose output is newer than the blast result",
+        )
+        parser.add_argument(
+            "-c",
+            "--catalog",
+            action="store",
+            help="Read the BLAST results from this gene catalog (shared/gene_catalog.py) instead of parsing the files, ingesting a file first if it is new or has changed",
+        )
+        parser.add_argument(
+            "-k",
+            "--top-k",
+            type=int,
+            action="store",
+            help="Keep only the best N hits of each query (lowest evalue, then highest bit score)",
+        )
+        parser.add_argument(
+            "--min-qcov",
+            type=float,
+            action="store",
+            help="Drop hits covering less than this percentage of the query, from q. start, q. end and query length",
+        )
+        parser.add_argument(
+            "--min-identity",
+            type=float,
+            action="store",
+            help="Drop hits below this percentage identity, needs the '%% identity' field or the 'identical' and 'alignment length' fields",
         )
+        table_io.add_format_argument(parser)
         if len(sys.argv) == 1:
             parser.print_help(sys.stderr)
             sys.exit(1)
@@ -32,36 +82,71 @@ def get_args():
     return parser.parse_args()
 
 
-# Process BLAST results and create a DataFrame
-def process_blast_results(file_path):
-    with open(file_path, 'r') as file:
-        blast_results = file.read()
-
-    data = []
-    for line in blast_results.split('\n'):
-        if line.startswith('# Query:'):
-            current_query = line.split()[2]
-        elif line.startswith('# Database:'):
-            current_database = line.split(': ')[1]
-        elif line.startswith('# 0 hits found') or line.startswith('# 1 hits found'):
-            hits_found = int(line.split()[1])
-            if hits_found == 0:
-                data.append({
-                    'Query': current_query,
-                    'Database': current_database,
-                    'Hits found': hits_found,
-                    **{field: '' for field in fields}
-                })
-        elif not line.startswith('#'):
-            hit_values = line.split('\t')
-            if hit_values and len(hit_values) > 1:
-                hit_data = dict(zip(fields, hit_values))
-                hit_data['Query'] = current_query
-                hit_data['Database'] = current_database
-                hit_data['Hits found'] = 1
-                data.append(hit_data)
-
-    return pd.DataFrame(data)
+def expand_file_paths(file_args):
+    """Expands the comma separated -f entries: folders to the .txt files in them, glob patterns to the files they match. Duplicates (the same file reached twice) are dropped."""
+    file_paths = []
+    for entry in file_args.split(","):
+        if os.path.isdir(entry):
+            file_paths.extend(sorted(glob(os.path.join(entry, "*.txt"))))
+        elif any(char in entry for char in "*?["):
+            file_paths.extend(sorted(glob(entry)))
+        else:
+            file_paths.append(entry)
+    return list(dict.fromkeys(os.path.normpath(file_path) for file_path in file_paths))
+
+def get_table_path(file_path, table_format):
+    """The output table next to the blast result, with the format's extension instead of .txt."""
+    return os.path.splitext(file_path)[0] + f'.{table_format}'
+
+def get_options_path(table_path):
+    """The sidecar recording the options an output table was written with."""
+    return f'{table_path}.json'
+
+def get_options(catalog, top_k, min_qcov, min_identity):
+    """The options changing what goes into an output table, as recorded in its sidecar."""
+    return {'catalog': bool(catalog), 'top_k': top_k, 'min_qcov': min_qcov, 'min_identity': min_identity}
+
+def read_options(table_path):
+    """The options recorded for an output table, the defaults for a table written before sidecars existed, or None for a cleared or unreadable sidecar."""
+    options_path = get_options_path(table_path)
+    if not os.path.exists(options_path):
+        return get_options(None, None, None, None)
+    try:
+        with open(options_path, 'r') as options_file:
+            return json.load(options_file)
+    except (OSError, ValueError):
+        return None
+
+def write_options(table_path, options):
+    """Writes the sidecar of an output table under a temporary name and renames it, so it is never seen half written."""
+    options_path = get_options_path(table_path)
+    temp_path = f'{options_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as options_file:
+        json.dump(options, options_file)
+    os.replace(temp_path, options_path)
+
+def is_up_to_date(file_path, table_path, options):
+    """True if the output exists, is newer than the blast result it was made from and was written with the same options."""
+    if not os.path.exists(table_path) or os.path.getmtime(table_path) < os.path.getmtime(file_path):
+        return False
+    return read_options(table_path) == options
+
+def convert_file(job):
+    """Process pool entry point: converts one blast result file to a table. Returns (output path, rows, input bytes, seconds)."""
+    file_path, table_path, catalog, top_k, min_qcov, min_identity = job
+    start = time.perf_counter()
+    if catalog:
+        # Each worker opens its own catalog connection, sqlite connections cannot be shared between processes
+        conn = gene_catalog.connect(catalog)
+        df = gene_catalog.get_blast_results(conn, file_path)
+        conn.close()
+    else:
+        df = process_blast_results(file_path, top_k, min_qcov, min_identity)
+    # The sidecar is cleared first, so a table left half rewritten is never taken for one made with the old options
+    write_options(table_path, None)
+    table_io.write_table(df, table_path)
+    write_options(table_path, get_options(catalog, top_k, min_qcov, min_identity))
+    return table_path, len(df), os.path.getsize(file_path), time.perf_counter() - start
 
 def main():
     args = get_args()
@@ -70,18 +155,49 @@ def main():
         sys.stderr.write("No file or comma separated list of files provided. Exiting.")
         sys.exit(1)
     else:
-        file_paths = args.file.split(",")
+        file_paths = expand_file_paths(args.file)
+    if not file_paths:
+        sys.stderr.write(f"No files found for {args.file}. Exiting.")
+        sys.exit(1)
+
+    if args.top_k is not None and args.top_k < 1:
+        sys.stderr.write("--top-k must be at least 1. Exiting.")
+        sys.exit(1)
+    if args.catalog and (args.top_k is not None or args.min_qcov is not None or args.min_identity is not None):
+        # The catalog stores every hit, the reduction is only done while parsing the files
+        sys.stderr.write("--top-k, --min-qcov and --min-identity cannot be used with --catalog. Exiting.")
+        sys.exit(1)
 
-    # Initialize dictionary to hold DataFrame and corresponding excel path for each file
-    dfs_and_paths = {}
+    table_format = table_io.get_output_format(args.format)
 
-    # Process each file
+    jobs = []
+    options = get_options(args.catalog, args.top_k, args.min_qcov, args.min_identity)
     for file_path in file_paths:
-        df = process_blast_results(file_path)
-        excel_path = file_path.replace('.txt', '.xlsx')
-        df.to_excel(excel_path, index=False)
-        dfs_and_paths[file_path] = excel_path
-        print(f'Wrote {excel_path} to disk...')
+        table_path = get_table_path(file_path, table_format)
+        if not args.force and is_up_to_date(file_path, table_path, options):
+            print(f'Skipping {file_path}, {table_path} is up to date...')
+            continue
+        jobs.append((file_path, table_path, args.catalog, args.top_k, args.min_qcov, args.min_identity))
+
+    # Process each file, reporting each one as it finishes
+    start = time.perf_counter()
+    total_rows = total_bytes = 0
+    if args.workers > 1 and len(jobs) > 1:
+        pool = Pool(min(args.workers, len(jobs)))
+        results = pool.imap_unordered(convert_file, jobs)
+    else:
+        pool = None
+        results = map(convert_file, jobs)
+    for table_path, rows, size, seconds in results:
+        total_rows += rows
+        total_bytes += size
+        print(f'Wrote {table_path} to disk... ({rows} rows, {size / 1e6:.1f} MB in {seconds:.2f}s, {size / 1e6 / max(seconds, 1e-9):.1f} MB/s)')
+    if pool:
+        pool.close()
+        pool.join()
+    elapsed = time.perf_counter() - start
+    if jobs:
+        print(f'Converted {len(jobs)} files ({total_rows} rows, {total_bytes / 1e6:.1f} MB) in {elapsed:.2f}s, {total_bytes / 1e6 / max(elapsed, 1e-9):.1f} MB/s overall')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
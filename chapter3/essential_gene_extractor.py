@@ -5,16 +5,27 @@
 import pandas as pd
 import argparse
 import os
-
-def filter_locus_tags(input_file, species_prefix):
-    # Load the spreadsheet
-    df = pd.read_excel(input_file)
-
-    # Filter for locus tags with 0 test_num_insertions_mapped_per_feat and type CDS
-    cds_essential_locus_tags = df[(df['test_num_insertions_mapped_per_feat'] == 0) & (df['type'] == 'CDS')]['locus_tag']
-
-    # Filter for locus tags with 0 test_num_insertions_mapped_per_feat but type is not CDS
-    non_cds_essential_locus_tags = df[(df['test_num_insertions_mapped_per_feat'] == 0) & (df['type'] != 'CDS')]['locus_tag']
+import sys
+# the modules shared by the chapters are in shared/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import gene_catalog
+
+def filter_locus_tags(input_file, species_prefix, catalog=None):
+    if catalog:
+        # Query the indexed essentiality table instead of re-reading the spreadsheet (it is ingested on first use)
+        conn = gene_catalog.connect(catalog)
+        cds_essential_locus_tags = gene_catalog.get_essential_locus_tags(conn, input_file, cds=True)
+        non_cds_essential_locus_tags = gene_catalog.get_essential_locus_tags(conn, input_file, cds=False)
+        conn.close()
+    else:
+        # Load the spreadsheet
+        df = pd.read_excel(input_file)
+
+        # Filter for locus tags with 0 test_num_insertions_mapped_per_feat and type CDS
+        cds_essential_locus_tags = df[(df['test_num_insertions_mapped_per_feat'] == 0) & (df['type'] == 'CDS')]['locus_tag']
+
+        # Filter for locus tags with 0 test_num_insertions_mapped_per_feat but type is not CDS
+        non_cds_essential_locus_tags = df[(df['test_num_insertions_mapped_per_feat'] == 0) & (df['type'] != 'CDS')]['locus_tag']
 
     # Save the lists to separate .txt files
     cds_file_path = species_prefix + '_essential_locus_tags.txt'
@@ -41,7 +52,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Filter locus tags based on criteria.")
     parser.add_argument("-i", "--input", required=True, help="Input Excel file path.")
     parser.add_argument("-o", "--output", required=True, help="Output species specific CDS essential locus tags as a text file.")
+    parser.add_argument("-c", "--catalog", help="Read the PIMMS results from this gene catalog (shared/gene_catalog.py) instead of the Excel file, ingesting the file first if it is new or has changed.")
     
     args = parser.parse_args()
     
-    filter_locus_tags(args.input, args.output)
+    filter_locus_tags(args.input, args.output, args.catalog)
@@ -1,77 +1,223 @@
-# the inputs for this script are base species essential vs other species essential database blast result spreadsheets generated by blast_to_spreadsheet.py
-# the outputs are spreadsheets showing the equivalent gene tags in other species for each blast query from the base species
+# the inputs for this script are base species essential vs other species essential database blast result tables (.parquet, .feather or .xlsx) generated by blast_to_spreadsheet.py
+# the outputs are tables showing the equivalent gene tags in other species for each blast query from the base species, Parquet by default (--format, see shared/table_io.py)
 # this script was used to create equivalency tables for blast results, these are the inputs for merge2.py which will create a single presence/absence matrix
+# a query is matched to a target gene only when they are reciprocal best hits (lowest evalue, then highest bit score, in both the origin vs target and target vs origin tables), --one_way keeps every best hit
+# the hits of every table are held as a sparse hit matrix (hit_matrix.py) saved as .npz in --matrix_folder with the sha256 of the table, so later runs skip re-reading unchanged tables. Requires scipy.
+# the matches of every species pair are cached in <output_folder>/rbh_cache, keyed by the sha256 of the pair's two blast tables and the options, so when a species is added
+# or a table changes only the new or changed pairs are resolved again and only the presence matrices of the species they involve are rewritten
+# the manifest also records the size and mtime of every presence matrix written, a matrix changed or removed since is rewritten too
+# a species left without any match gets an empty presence matrix, indexed by query id like the others
+# with --sparse the matches are written as long-form <species>_presence_pairs tables instead, which only hold the present cells
 
 
+import numpy as np
 import pandas as pd
 import os
+import sys
+import json
+import hashlib
+import argparse
 from glob import glob
 from collections import defaultdict
+# the modules shared by the chapters are in shared/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import table_io
+from hit_matrix import HitMatrix, SCORES
 
-def generate_presence_matrices_with_eval_resolution(input_folder, output_folder):
+RBH_CACHE_FOLDER = "rbh_cache"
+MANIFEST_NAME = "rbh_manifest.json"
+HIT_COLUMNS = ["query id", "subject id", "evalue", "bit score"]
+COVERAGE_COLUMNS = ["q. start", "q. end", "query length"]
+
+def find_blast_tables(input_folder):
+    """The *_essential_vs_*essentialdb blast tables in the folder, one per species pair, Parquet preferred over Feather over Excel when a pair has several."""
+    tables = {}
+    for table_format in reversed(table_io.FORMATS):
+        for filepath in glob(os.path.join(input_folder, f"*_essential_vs_*essentialdb.{table_format}")):
+            tables[os.path.splitext(filepath)[0]] = filepath
+    return [tables[stem] for stem in sorted(tables)]
+
+def read_hits(filepath):
+    """The hits of a blast table: query id, subject id, evalue, bit score and qcov, the query coverage (%) from q. start, q. end and query length.
+    bit score and qcov are NaN when the table does not have their fields."""
+    # Only these columns are read, and only the rows of queries with hits
+    columns = [column for column in HIT_COLUMNS + COVERAGE_COLUMNS if column in table_io.get_columns(filepath)]
+    df = table_io.read_table(filepath, columns=columns, filters=[("Hits found", ">", 0)])
+    for column in HIT_COLUMNS + COVERAGE_COLUMNS:
+        if column not in df.columns:
+            df[column] = np.nan
+    df = df.dropna(subset=["query id", "subject id", "evalue"])
+    q_start, q_end, query_length = (df[column].astype(float) for column in COVERAGE_COLUMNS)
+    return pd.DataFrame({
+        "query id": df["query id"].astype(str),
+        "subject id": df["subject id"].astype(str),
+        "evalue": df["evalue"].astype(float),
+        "bit score": df["bit score"].astype(float),
+        "qcov": ((q_end - q_start).abs() + 1) / query_length * 100,
+    })
+
+def load_hit_matrix(filepath, matrix_folder, score, sha256):
+    """The HitMatrix of a blast table, from its .npz in matrix_folder when that was built from a table with this sha256 and has the same score, else built and saved there."""
+    npz_path = os.path.join(matrix_folder, os.path.splitext(os.path.basename(filepath))[0] + ".npz")
+    if os.path.exists(npz_path):
+        matrix = HitMatrix.load(npz_path)
+        if matrix.sha256 == sha256 and matrix.score == score:
+            return matrix
+    matrix = HitMatrix.from_hits(read_hits(filepath), score, sha256)
+    # Saved under a temporary name and renamed, so an interrupted run never leaves a half written matrix
+    temp_path = f"{npz_path}.{os.getpid()}.tmp.npz"
+    matrix.save(temp_path)
+    os.replace(temp_path, npz_path)
+    return matrix
+
+def get_file_hash(filepath):
+    """sha256 of a file, read in 1 MiB blocks."""
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def get_table_hash(filepath, table_hashes):
+    """sha256 of a blast table, taken from table_hashes (updated in place) while the table's size and mtime are unchanged."""
+    stat = os.stat(filepath)
+    entry = table_hashes.get(os.path.basename(filepath))
+    if not entry or (entry["size"], entry["mtime"]) != (stat.st_size, stat.st_mtime):
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": get_file_hash(filepath)}
+        table_hashes[os.path.basename(filepath)] = entry
+    return entry["sha256"]
+
+def load_manifest(manifest_path):
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as fh:
+            return json.load(fh)
+    return {}
+
+def save_manifest(manifest, manifest_path):
+    # Written under a temporary name and renamed, so an interrupted run never leaves a half written manifest
+    temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+def get_output_entry(output_path):
+    """The manifest entry of a written presence matrix: its file name, size and mtime."""
+    stat = os.stat(output_path)
+    return {"path": os.path.basename(output_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+def is_output_unchanged(output_path, entry):
+    """True if the presence matrix is still the file the manifest entry was recorded for."""
+    return bool(entry) and os.path.exists(output_path) and get_output_entry(output_path) == entry
+
+def get_hit_matrix(filepath, sha256, hit_matrices, matrix_folder, score, min_qcov):
+    """The (coverage filtered) HitMatrix of a blast table, loaded once per run into hit_matrices."""
+    if filepath not in hit_matrices:
+        matrix = load_hit_matrix(filepath, matrix_folder, score, sha256)
+        hit_matrices[filepath] = matrix.filter_coverage(min_qcov) if min_qcov is not None else matrix
+    return hit_matrices[filepath]
+
+def generate_presence_matrices_with_eval_resolution(input_folder, output_folder, table_format="parquet", one_way=False,
+                                                    matrix_folder=None, score="evalue", min_qcov=None, sparse=False, force=False):
     os.makedirs(output_folder, exist_ok=True)
-    blast_files = sorted(glob(os.path.join(input_folder, "*_essential_vs_*essentialdb.xlsx")))
+    matrix_folder = matrix_folder or os.path.join(output_folder, "hit_matrices")
+    os.makedirs(matrix_folder, exist_ok=True)
+    cache_folder = os.path.join(output_folder, RBH_CACHE_FOLDER)
+    os.makedirs(cache_folder, exist_ok=True)
+    # The cached matches are internal, they are kept as Parquet whatever the output format
+    cache_format = "parquet" if table_io.HAVE_PYARROW else "xlsx"
+    manifest_path = os.path.join(cache_folder, MANIFEST_NAME)
+    manifest = {} if force else load_manifest(manifest_path)
+    blast_files = find_blast_tables(input_folder)
 
-    # Load all blast files into a lookup
-    all_hits = defaultdict(lambda: defaultdict(list))  # {origin -> {target -> list of hits}}
+    # Find the blast table of every species pair
+    blast_tables = {}  # {(origin, target) -> blast table path}
     for filepath in blast_files:
         filename = os.path.basename(filepath)
         if "_essential_vs_" not in filename:
             continue
 
-        origin, rest = filename.split("_essential_vs_")
-        target = rest.replace("essentialdb.xlsx", "")
+        origin, rest = os.path.splitext(filename)[0].split("_essential_vs_")
+        target = rest.replace("essentialdb", "")
         if origin == target:
             continue
+        blast_tables[(origin, target)] = filepath
+
+    # Keep the reciprocal best hits of every species pair, reusing the cached matches of the pairs whose two tables and options are unchanged
+    table_hashes = manifest.get("tables", {})
+    cached_pairs = manifest.get("pairs", {})
+    pair_entries = {}
+    hit_matrices = {}
+    affected = set()
+    recomputed = 0
+    resolved_pairs = defaultdict(list)  # {origin -> [DataFrames of query id, target, subject id]}
+    for (origin, target), filepath in blast_tables.items():
+        reverse_path = blast_tables.get((target, origin))
+        if reverse_path is None and not one_way:
+            print(f"No {target}_essential_vs_{origin}essentialdb table, no reciprocal best hits for {origin} vs {target}")
+            continue
+        pair_name = f"{origin}_vs_{target}"
+        forward_hash = get_table_hash(filepath, table_hashes)
+        reverse_hash = get_table_hash(reverse_path, table_hashes) if reverse_path and not one_way else None
+        pair_key = hashlib.sha256(json.dumps([forward_hash, reverse_hash, one_way, score, min_qcov]).encode()).hexdigest()
+        cache_path = os.path.join(cache_folder, f"{pair_name}.{cache_format}")
+        if cached_pairs.get(pair_name, {}).get("key") == pair_key and os.path.exists(cache_path):
+            pairs = table_io.read_table(cache_path)
+        else:
+            forward = get_hit_matrix(filepath, forward_hash, hit_matrices, matrix_folder, score, min_qcov)
+            if one_way:
+                pairs = forward.best_hit_pairs()
+            else:
+                pairs = forward.reciprocal_best_hits(get_hit_matrix(reverse_path, reverse_hash, hit_matrices, matrix_folder, score, min_qcov))
+            table_io.write_table(pairs, cache_path)
+            affected.add(origin)
+            recomputed += 1
+        pair_entries[pair_name] = {"key": pair_key, "origin": origin}
+        if len(pairs):
+            resolved_pairs[origin].append(pairs.assign(target=target))
+
+    # A pair whose table is gone changes its origin's matrix too
+    affected.update(entry["origin"] for pair_name, entry in cached_pairs.items() if pair_name not in pair_entries)
+    print(f"Resolved {recomputed} of {len(pair_entries)} species pairs, the others were unchanged")
 
-        df = pd.read_excel(filepath)
-        for _, row in df.iterrows():
-            query = str(row.get("query id"))
-            subject = str(row.get("subject id"))
-            evalue = row.get("evalue")
-            if pd.isna(query) or pd.isna(subject) or pd.isna(evalue):
-                continue
-            all_hits[origin][target].append((query, subject, float(evalue)))
-
-    # Resolve best matches accounting for bidirectional hits
-    resolved_matches = defaultdict(lambda: defaultdict(dict))  # {origin -> {query -> {target: subject}}}
-    for origin in all_hits:
-        for target in all_hits[origin]:
-            # Forward and reverse
-            forward = all_hits[origin][target]
-            reverse = all_hits[target][origin]
-
-            # Build quick lookups
-            forward_dict = {(q, s): e for q, s, e in forward}
-            reverse_dict = {(s, q): e for q, s, e in reverse}
-
-            used_queries = set()
-
-            for (q, s), f_eval in forward_dict.items():
-                if (q in used_queries): continue
-                r_eval = reverse_dict.get((q, s), 50)  # Pretend reverse is just at threshold if missing
-                best_eval = min(f_eval, r_eval)
-                if best_eval == f_eval:
-                    resolved_matches[origin][q][target] = s
-                else:
-                    resolved_matches[origin][q][target] = s  # Same subject; reverse had better evalue
-                used_queries.add(q)
-
-    # Write per-species presence matrix
-    for origin_species, query_map in resolved_matches.items():
-        all_queries = sorted(query_map.keys())
-        all_targets = sorted({t for targets in query_map.values() for t in targets})
-        matrix = pd.DataFrame(index=all_queries, columns=all_targets)
-
-        for query, targets in query_map.items():
-            for target, subject in targets.items():
-                matrix.at[query, target] = subject
-
-        output_path = os.path.join(output_folder, f"{origin_species}_presence_matrix.xlsx")
-        matrix.to_excel(output_path)
+    # Write per-species presence matrix, built in one step from the long form of its matches
+    # Only the matrices of species with new or changed pairs, or whose file is not the one last written, are rewritten
+    # A species without any match (left) gets an empty matrix, so merge2.py finds one for every species and no stale matches are kept
+    cached_outputs = manifest.get("outputs", {})
+    output_entries = {}
+    for origin_species in sorted(affected | {entry["origin"] for entry in pair_entries.values()}):
+        layout = "pairs" if sparse else "matrix"
+        output_path = os.path.join(output_folder, f"{origin_species}_presence_{layout}.{table_format}")
+        if origin_species not in affected and is_output_unchanged(output_path, cached_outputs.get(origin_species)):
+            output_entries[origin_species] = cached_outputs[origin_species]
+            print(f"Unchanged matrix: {output_path}")
+            continue
+        if origin_species in resolved_pairs:
+            pairs = pd.concat(resolved_pairs[origin_species], ignore_index=True)[table_io.PAIRS_COLUMNS]
+        else:
+            pairs = pd.DataFrame({column: pd.Series(dtype=object) for column in table_io.PAIRS_COLUMNS})
+        if sparse:
+            # Only the present cells are stored, the gene ids and species as dictionary encoded categories
+            table_io.write_table(pairs.astype("category"), output_path)
+        else:
+            table_io.write_table(table_io.pairs_to_matrix(pairs), output_path, index=True)
+        output_entries[origin_species] = get_output_entry(output_path)
         print(f"Saved matrix: {output_path}")
 
+    # The manifest is only saved once every matrix is written, so an interrupted run resolves and rewrites the same species again
+    save_manifest({"tables": {name: entry for name, entry in table_hashes.items() if name in map(os.path.basename, blast_files)},
+                   "pairs": pair_entries, "outputs": output_entries}, manifest_path)
+
 if __name__ == "__main__":
-    input_dir = "./"                  # Folder with *_essential_vs_*essentialdb.xlsx files
-    output_dir = "./resolved_matrices"
-    generate_presence_matrices_with_eval_resolution(input_dir, output_dir)
+    parser = argparse.ArgumentParser(description="Build a presence matrix per species from the pairwise essential gene blast tables.")
+    parser.add_argument("-i", "--input_folder", default="./", help="Folder with the *_essential_vs_*essentialdb tables (default: ./).")
+    parser.add_argument("-o", "--output_folder", default="./resolved_matrices", help="Folder to write the presence matrices to (default: ./resolved_matrices).")
+    parser.add_argument("--one_way", action="store_true", help="Keep the best hit of every query even when it is not reciprocal, e.g. when only one direction of a species pair was blasted.")
+    parser.add_argument("-m", "--matrix_folder", help="Folder of the .npz hit matrices (hit_matrix.py), reused while their blast table's sha256 is unchanged (default: <output_folder>/hit_matrices).")
+    parser.add_argument("--score", choices=SCORES, default="evalue", help="Hit score stored in the hit matrices, -log10(evalue) or the bit score (default: evalue).")
+    parser.add_argument("--min_qcov", type=float, help="Ignore hits covering less than this percentage of the query, needs the q. start, q. end and query length fields.")
+    parser.add_argument("--sparse", action="store_true", help="Write each presence matrix as a long-form <species>_presence_pairs table holding only the matches (query id, target, subject id), for species with many absences. merge2.py reads either layout.")
+    parser.add_argument("--force", action="store_true", help=f"Resolve every species pair and rewrite every matrix, ignoring the matches cached in <output_folder>/{RBH_CACHE_FOLDER}.")
+    table_io.add_format_argument(parser)
+    args = parser.parse_args()
+    generate_presence_matrices_with_eval_resolution(args.input_folder, args.output_folder, table_io.get_output_format(args.format), args.one_way,
+                                                    args.matrix_folder, args.score, args.min_qcov, args.sparse, args.force)
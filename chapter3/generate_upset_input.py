@@ -1,20 +1,27 @@
-# the input for this script is the deduplicated_full_matrix.xlsx created by merge2.py
+# the input for this script is the deduplicated_full_matrix table (.parquet, .feather or .xlsx) created by merge2.py
 # the output is a .txt file showing the number of essential genes for each intersection of species
 # this script was used to generate the inputs for essential_upset.R
+# the species names and columns come from species_registry.json
 
-import pandas as pd
 import itertools
-
-df = pd.read_excel("deduplicated_full_matrix.xlsx")
-
-species_columns = {
-    "S.Pneumoniae": "pneumo",
-    "S.Suis": "suis",
-    "S.Agalactiae": "agal",
-    "S.Equi_sb_equi": "equi",
-    "S.Iniae": "iniae",
-    "S.Uberis": "uberis"
-}
+import argparse
+import os
+import sys
+# the modules shared by the chapters are in shared/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import species_registry, table_io
+
+parser = argparse.ArgumentParser(description="Count the essential genes in each intersection of species for essential_upset.R.")
+species_registry.add_registry_argument(parser)
+args = parser.parse_args()
+
+species_columns = species_registry.get_species_names(species_registry.load_registry(args.registry))
+
+# Only the species columns are read
+matrix_file = table_io.find_table("deduplicated_full_matrix")
+if matrix_file is None:
+    sys.exit("No .parquet, .feather or .xlsx table found for deduplicated_full_matrix, run merge2.py first")
+df = table_io.read_table(matrix_file, columns=[col for col in table_io.get_columns(matrix_file) if col in species_columns.values()])
 
 column_to_species = {v: k for k, v in species_columns.items()}
 
@@ -0,0 +1,117 @@
+# sparse store of the blast hit scores of one species pair (origin queries x target subjects), used by generate_all_presence_matrices_V2.py
+# a HitMatrix is a scipy.sparse CSR matrix indexed by integer gene ids, with -log10(evalue) or the bit score as values, and the query coverage of every hit alongside
+# the entries of each row are stored best hit first (lowest evalue, then highest bit score, then table order), so the first maximum of a row is the query's best hit
+# best hits, reciprocal best hits and coverage filters are reductions over the rows of the matrices; matrices are saved as .npz (readable by scipy.sparse.load_npz too) to be reused across runs
+# Requires scipy.
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+SCORES = ["evalue", "bitscore"]
+# An evalue of 0 scores as the smallest positive double would
+MIN_EVALUE = np.finfo(float).tiny
+
+class HitMatrix:
+    """Hit scores of one species pair: row i is query queries[i], column j subject subjects[j], and every hit (HSP) between them is an entry of scores.
+    A query/subject pair with several hits has several entries, so the coverage filter sees each of them; the matrix is not summed into canonical form.
+    qcov holds the query coverage (%) of the same hits, aligned with scores.data (NaN when the blast table had no coordinates).
+    sha256 is the hash of the blast table the matrix was built from, if known, so a saved matrix can be checked against the table."""
+
+    def __init__(self, queries, subjects, scores, qcov, score="evalue", sha256=None):
+        self.queries = pd.Index(queries)
+        self.subjects = pd.Index(subjects)
+        self.scores = scores
+        self.qcov = qcov
+        self.score = score
+        self.sha256 = sha256
+
+    @classmethod
+    def from_hits(cls, hits, score="evalue", sha256=None):
+        """Builds the matrix from a DataFrame of query id, subject id, evalue, bit score and qcov columns, one row per hit."""
+        if score == "bitscore" and hits["bit score"].isna().any():
+            raise ValueError("Scoring by bit score needs the 'bit score' field in the blast tables")
+        query_codes, queries = pd.factorize(hits["query id"])
+        subject_codes, subjects = pd.factorize(hits["subject id"])
+        evalues = hits["evalue"].to_numpy(dtype=float)
+        bit_scores = hits["bit score"].to_numpy(dtype=float)
+        # lexsort is stable and sorts on its last key first: rows by query, each row best hit first
+        order = np.lexsort((np.nan_to_num(-bit_scores, nan=0.0), evalues, query_codes))
+        indptr = np.zeros(len(queries) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(query_codes[order], minlength=len(queries)), out=indptr[1:])
+        if score == "bitscore":
+            values = bit_scores[order]
+        else:
+            values = -np.log10(np.maximum(evalues[order], MIN_EVALUE))
+        scores = sp.csr_matrix((values, subject_codes[order], indptr), shape=(len(queries), len(subjects)))
+        return cls(queries, subjects, scores, hits["qcov"].to_numpy(dtype=float)[order], score, sha256)
+
+    def row_of_entries(self):
+        """The row number of every stored entry."""
+        return np.repeat(np.arange(self.scores.shape[0]), np.diff(self.scores.indptr))
+
+    def filter_coverage(self, min_qcov):
+        """A new matrix without the hits covering less than min_qcov % of their query, entries keep their order."""
+        if np.isnan(self.qcov).any():
+            raise ValueError("Filtering on query coverage needs the 'q. start', 'q. end' and 'query length' fields in the blast tables")
+        keep = self.qcov >= min_qcov
+        indptr = np.zeros(len(self.queries) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.row_of_entries()[keep], minlength=len(self.queries)), out=indptr[1:])
+        scores = sp.csr_matrix((self.scores.data[keep], self.scores.indices[keep], indptr), shape=self.scores.shape)
+        return HitMatrix(self.queries, self.subjects, scores, self.qcov[keep], self.score, self.sha256)
+
+    def best_hits(self):
+        """Row reduction: (row, column) arrays of the best hit of every query with hits, the first maximum of the row."""
+        counts = np.diff(self.scores.indptr)
+        rows = np.flatnonzero(counts)
+        if len(rows) == 0:
+            return rows, rows
+        data = self.scores.data
+        # Rows without entries take no space in data, so the segments of the other rows are contiguous
+        row_max = np.maximum.reduceat(data, self.scores.indptr[rows])
+        is_max = np.flatnonzero(data == np.repeat(row_max, counts[rows]))
+        _, first = np.unique(self.row_of_entries()[is_max], return_index=True)
+        return rows, self.scores.indices[is_max[first]]
+
+    def best_hit_pairs(self):
+        """DataFrame of query id and subject id of the best hit of every query."""
+        rows, columns = self.best_hits()
+        return pd.DataFrame({"query id": self.queries[rows], "subject id": self.subjects[columns]})
+
+    def reciprocal_best_hits(self, reverse):
+        """DataFrame of query id and subject id of the reciprocal best hits, reverse being the matrix of the target vs origin blast."""
+        rows, columns = self.best_hits()
+        reverse_rows, reverse_columns = reverse.best_hits()
+        # Best origin gene (as a row of this matrix) of every target gene with hits (as a column of this matrix), -1 when there is none
+        best_of_subject = np.full(len(self.subjects), -1)
+        subject_columns = self.subjects.get_indexer(reverse.queries[reverse_rows])
+        query_rows = self.queries.get_indexer(reverse.subjects[reverse_columns])
+        known = subject_columns >= 0
+        best_of_subject[subject_columns[known]] = query_rows[known]
+        mutual = best_of_subject[columns] == rows
+        return pd.DataFrame({"query id": self.queries[rows[mutual]], "subject id": self.subjects[columns[mutual]]})
+
+    def save(self, path):
+        """Saves the matrix as .npz, under the keys of scipy.sparse.save_npz plus the gene ids, coverage, score and table hash (empty when unknown)."""
+        np.savez_compressed(
+            path,
+            format=np.array("csr"),
+            shape=np.array(self.scores.shape),
+            data=self.scores.data,
+            indices=self.scores.indices,
+            indptr=self.scores.indptr,
+            qcov=self.qcov,
+            queries=np.array(self.queries, dtype=str),
+            subjects=np.array(self.subjects, dtype=str),
+            score=np.array(self.score),
+            sha256=np.array(self.sha256 or ""),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as loaded:
+            # The stored entry order is kept, the rows are not re-sorted by column
+            scores = sp.csr_matrix((loaded["data"], loaded["indices"], loaded["indptr"]), shape=tuple(loaded["shape"]))
+            # Matrices saved before the table hash was stored have none
+            sha256 = str(loaded["sha256"]) if "sha256" in loaded.files else ""
+            return cls(loaded["queries"], loaded["subjects"], scores, loaded["qcov"], str(loaded["score"]), sha256 or None)
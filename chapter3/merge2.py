@@ -1,48 +1,169 @@
-# the inputs for this file are the $species_presence_matrix.xlsx outputs from generate_all_presence_matrices_V2.py as well as the "no_results_all_species.xlsx" file which was made manually by just copy pasting all the 
+# the inputs for this file are the $species_presence_matrix tables (.parquet, .feather or .xlsx) from generate_all_presence_matrices_V2.py as well as the "no_results_all_species.xlsx" file which was made manually by just copy pasting all the
 # blast query ID's with no hits from each species into a spreadsheet with the same columns/column order,and leaving the rest of the row empty for each query
-# the ouput is a single deduplicated_full_matrix.xlsx file
+# the ouput is a single deduplicated_full_matrix table, Parquet by default (--format, see shared/table_io.py)
 # this script creates the essential gene presence/absence spreadsheet used as input for generate_upset_input.py and for essential_all_extractor.py
+# the species (and so the matrix files and columns) come from species_registry.json, the matrices are read in parallel
+# rows are joined into ortholog groups: every (species, tag) is a node and every row links its tags, so rows of the same group from different origin species
+# become one row even when they differ in a cell; a species with several tags in a group has them comma separated (--exact_rows keeps the old exact duplicate row removal)
+# a species' matrix can also be a long-form $species_presence_pairs table (generate_all_presence_matrices_V2.py --sparse)
+# the queries of a species' matrix are its index (or query id column), they fill the species' own column so a row joins its query to its matches
 
+import numpy as np
 import pandas as pd
 import os
+import sys
+import argparse
+from multiprocessing import Pool
+# the modules shared by the chapters are in shared/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import gene_catalog, species_registry, table_io
 
-species_files = {
-    "equi": "equi_presence_matrix.xlsx",
-    "iniae": "iniae_presence_matrix.xlsx",
-    "uberis": "uberis_presence_matrix.xlsx",
-    "pneumo": "pneumo_presence_matrix.xlsx",
-    "suis": "suis_presence_matrix.xlsx",
-    "agal": "agal_presence_matrix.xlsx"
-}
-
-# Get all possible columns in order
-all_cols = ['equi', 'iniae', 'uberis', 'pneumo', 'suis', 'agal']
-
-# Collect all rows from all files
-rows = []
-for file in species_files.values():
-    df = pd.read_excel(file)
+def read_matrix_rows(job):
+    """Process pool entry point: reads one presence matrix and returns its rows as tuples of all_cols, missing columns filled with pd.NA.
+    origin is the species whose queries the matrix rows are, its empty cells get the row's query id; None leaves the cells as stored."""
+    file, all_cols, catalog, origin = job
+    if catalog:
+        # Each worker opens its own catalog connection, sqlite connections cannot be shared between processes
+        conn = gene_catalog.connect(catalog)
+        rows = gene_catalog.get_presence_rows(conn, file, all_cols, origin)
+        conn.close()
+        return rows
+    # Only the species columns are read
+    df = table_io.read_presence_matrix(file, columns=all_cols)
     # Ensure all columns exist in correct order
     for col in all_cols:
         if col not in df.columns:
             df[col] = pd.NA
     df = df[all_cols]
+    # A table without query ids (no_results_all_species) has a RangeIndex, its rows are taken as they are
+    if origin is not None and not isinstance(df.index, pd.RangeIndex):
+        df[origin] = df[origin].where(df[origin].notna(), df.index.to_series(index=df.index))
     # Store every row as a tuple (for perfect uniqueness)
-    rows.extend([tuple(row) for row in df.values])
+    return [tuple(row) for row in df.values]
 
-# Also add from no_results
-no_results_file = "no_results_all_species.xlsx"
-if os.path.exists(no_results_file):
-    df = pd.read_excel(no_results_file)
-    for col in all_cols:
-        if col not in df.columns:
-            df[col] = pd.NA
-    df = df[all_cols]
-    rows.extend([tuple(row) for row in df.values])
+class OrthologClusters:
+    """Union-find over (species, tag) nodes. Every presence matrix row joins its tags into one ortholog group, so rows describing the same group
+    from different origin species end up in one group even when they differ in a cell. Rows are added one matrix at a time; between matrices only
+    the node arrays are kept, so memory stays linear in the number of tags."""
+
+    def __init__(self, species):
+        self.species = list(species)
+        self.node_ids = {species: {} for species in self.species}  # {species: {tag: node}}
+        self.parent = np.zeros(0, dtype=np.int64)
+        self.first_row = np.zeros(0, dtype=np.int64)
+        self.node_species = np.zeros(0, dtype=np.int64)
+        self.node_tags = []
+        self.rows = 0
+
+    def get_nodes(self, species_index, cells):
+        """Node of every cell of one species column, -1 for empty cells. Tags not seen before get new nodes, recording the row they first appear in."""
+        ids = self.node_ids[self.species[species_index]]
+        cells = pd.Series(cells, dtype=object).reset_index(drop=True)
+        present = cells.notna() & (cells.astype(str).str.strip() != "")
+        tags = cells[present].astype(str)
+        new_tags = tags[tags.map(ids).isna()].drop_duplicates()
+        start = len(self.parent)
+        ids.update(zip(new_tags, range(start, start + len(new_tags))))
+        self.parent = np.concatenate([self.parent, np.arange(start, start + len(new_tags))])
+        self.first_row = np.concatenate([self.first_row, self.rows + new_tags.index.to_numpy()])
+        self.node_species = np.concatenate([self.node_species, np.full(len(new_tags), species_index)])
+        self.node_tags.extend(new_tags)
+        nodes = np.full(len(cells), -1, dtype=np.int64)
+        nodes[present.to_numpy()] = tags.map(ids).to_numpy(dtype=np.int64)
+        return nodes
+
+    def find(self, nodes):
+        """Roots of the nodes, by pointer jumping; the nodes are then pointed straight at their roots (path compression)."""
+        roots = self.parent[nodes]
+        while True:
+            parents = self.parent[roots]
+            if (parents == roots).all():
+                break
+            roots = parents
+        self.parent[nodes] = roots
+        return roots
+
+    def union(self, u, v):
+        """Joins the groups of every edge (u[i], v[i]). The higher root is pointed at the lower one; when several edges write the same root
+        only one write lands, so the loop repeats on the edges whose ends are still in different groups."""
+        while len(u):
+            u_roots, v_roots = self.find(u), self.find(v)
+            split = u_roots != v_roots
+            u, v = u[split], v[split]
+            u_roots, v_roots = u_roots[split], v_roots[split]
+            self.parent[np.maximum(u_roots, v_roots)] = np.minimum(u_roots, v_roots)
+
+    def add_rows(self, df):
+        """Adds the rows of a presence matrix (columns in species order), joining every tag of a row to the row's first tag."""
+        nodes = np.column_stack([self.get_nodes(i, df[species]) for i, species in enumerate(self.species)])
+        anchors = nodes[np.arange(len(nodes)), (nodes >= 0).argmax(axis=1)]
+        u, v = np.repeat(anchors, len(self.species)), nodes.ravel()
+        edges = (u >= 0) & (v >= 0) & (u != v)
+        self.union(u[edges], v[edges])
+        self.rows += len(df)
+
+    def to_frame(self):
+        """One row per ortholog group, in the order the groups first appear. A species with several tags in a group has them comma separated, in the order they first appear."""
+        nodes = pd.DataFrame({
+            "group": self.find(np.arange(len(self.parent))),
+            "species": np.array(self.species, dtype=object)[self.node_species],
+            "tag": pd.Series(self.node_tags, dtype=object),
+            "first_row": self.first_row,
+        }).sort_values("first_row", kind="stable")
+        cells = nodes.groupby(["group", "species"], sort=False)["tag"].agg(",".join).unstack("species")
+        return cells.reindex(index=nodes["group"].drop_duplicates(), columns=self.species).reset_index(drop=True).rename_axis(columns=None)
+
+def find_presence_table(species):
+    """The presence matrix of a species, wide (<species>_presence_matrix) or long-form (<species>_presence_pairs), the newer one when both exist."""
+    files = [file for file in (table_io.find_table(f"{species}_presence_matrix"), table_io.find_table(f"{species}_presence_pairs")) if file]
+    return max(files, key=os.path.getmtime) if files else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the species presence matrices into a single deduplicated_full_matrix table.")
+    parser.add_argument("-c", "--catalog", help="Read the presence matrices from this gene catalog (shared/gene_catalog.py) instead of the table files, ingesting a file first if it is new or has changed.")
+    parser.add_argument("--exact_rows", action="store_true", help="Only drop rows that are exact duplicates instead of joining the rows into ortholog groups.")
+    parser.add_argument("-t", "--threads", type=int, help="Number of presence matrices read in parallel (default: one per CPU).")
+    species_registry.add_registry_argument(parser)
+    table_io.add_format_argument(parser)
+    args = parser.parse_args()
+
+    # Get all possible columns in order
+    all_cols = species_registry.get_species_keys(species_registry.load_registry(args.registry))
+    species_files = {species: find_presence_table(species) for species in all_cols}
+    missing = [species for species, file in species_files.items() if file is None]
+    if missing:
+        sys.exit(f"No .parquet, .feather or .xlsx presence matrix or presence pairs table found for {', '.join(missing)}")
+
+    # (file, origin species) of every matrix; --exact_rows keeps the rows as stored, as it always has
+    matrix_files = [(file, None if args.exact_rows else species) for species, file in species_files.items()]
+    # Also add from no_results
+    no_results_file = table_io.find_table("no_results_all_species")
+    if no_results_file:
+        matrix_files.append((no_results_file, None))
+
+    # Collect all rows from all files, in file order
+    jobs = [(file, all_cols, args.catalog, origin) for file, origin in matrix_files]
+    workers = species_registry.get_workers(args.threads, len(jobs))
+    pool = Pool(workers) if workers > 1 else None
+    file_rows = pool.imap(read_matrix_rows, jobs) if pool else map(read_matrix_rows, jobs)
+    if args.exact_rows:
+        rows = [row for rows_of_file in file_rows for row in rows_of_file]
+        # Convert to DataFrame, dropping only exact duplicate rows (not per-gene)
+        merged_df = pd.DataFrame(rows, columns=all_cols).drop_duplicates()
+    else:
+        # The rows of each matrix are joined into the ortholog groups as soon as it is read, then dropped
+        clusters = OrthologClusters(all_cols)
+        for rows_of_file in file_rows:
+            clusters.add_rows(pd.DataFrame(rows_of_file, columns=all_cols))
+        merged_df = clusters.to_frame()
+    if pool:
+        pool.close()
+        pool.join()
 
-# Convert to DataFrame, dropping only exact duplicate rows (not per-gene)
-merged_df = pd.DataFrame(rows, columns=all_cols).drop_duplicates()
+    # Save final result
+    output_path = f"deduplicated_full_matrix.{table_io.get_output_format(args.format)}"
+    table_io.write_table(merged_df, output_path)
+    print(f"Merged file with all mapping contexts saved to: {output_path}")
 
-# Save final result
-merged_df.to_excel("deduplicated_full_matrix.xlsx", index=False)
-print("Merged file with all mapping contexts saved to: deduplicated_full_matrix.xlsx")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-# input is the species name + its $speciesname_combined.xlsx spreadsheet
+# input is the species name + its $speciesname_combined table (.parquet, .feather or .xlsx) from blast_spreadsheet_combiner.py
 # output is a $speciesname_hits_matrix.xlsx spreadsheet which we can manually parse for the queries with 0 hits to add to no_results_all_species.xlsx, as well as some visualisations (heatmap + network graph)
 # this script was only used to be able to get the queries with 0 hits for no_results_all_species.xlsx
 
@@ -6,9 +6,13 @@ import pandas as pd
 import networkx as nx
 import matplotlib.pyplot as plt
 import seaborn as sns
+import os
 import sys
 import argparse
 from collections import defaultdict
+# the modules shared by the chapters are in shared/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import table_io
 
 def get_args():
     try:
@@ -27,7 +31,7 @@ def get_args():
             "--file",
             action="store",
             required=True,
-            help="The filename of the combined Excel file",
+            help="The filename of the combined table (.parquet, .feather or .xlsx)",
         )
         if len(sys.argv) == 1:
             parser.print_help(sys.stderr)
@@ -40,8 +44,8 @@ def get_args():
     return parser.parse_args()
 
 def GenerateQueriesPerNumberOfDatabasesWithHits(species_name, combined_excel_file):
-    # Load the spreadsheet
-    data = pd.read_excel(combined_excel_file)
+    # Load the columns used from the combined table
+    data = table_io.read_table(combined_excel_file, columns=['Query', 'Database', 'Hits found'])
 
     # Count number of unique databases
     num_databases = data['Database'].nunique()
@@ -80,7 +84,7 @@ def GenerateQueriesPerNumberOfDatabasesWithHits(species_name, combined_excel_fil
                 file.write(query + '\n')
 
 def GenerateNetworkGraphAndHeatmap(species_name, combined_excel_file):
-    df = pd.read_excel(combined_excel_file)
+    df = table_io.read_table(combined_excel_file, columns=['Query', 'Database', 'Hits found'])
 
     # Create binary matrix of hits
     hits_matrix = pd.pivot_table(
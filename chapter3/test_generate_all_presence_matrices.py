@@ -0,0 +1,49 @@
+# tests for generate_all_presence_matrices_V2.py: a rerun must rewrite the presence matrix of a species whose matches are gone
+# run with: python -m pytest test_generate_all_presence_matrices.py (from this folder)
+
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import generate_all_presence_matrices_V2 as presence
+# generate_all_presence_matrices_V2 puts the repository root on sys.path
+from shared import table_io
+
+def write_blast_table(folder, origin, target, hits):
+    """Writes an <origin>_essential_vs_<target>essentialdb table with one row per (query id, subject id) hit, as blast_to_spreadsheet.py writes them."""
+    queries = [query for query, subject in hits]
+    table_io.write_table(pd.DataFrame({
+        "Query": queries,
+        "Database": [target] * len(hits),
+        "Hits found": [1] * len(hits),
+        "query id": queries,
+        "subject id": [subject for query, subject in hits],
+        "evalue": [1e-20] * len(hits),
+        "bit score": [50.0] * len(hits),
+    }), str(folder / f"{origin}_essential_vs_{target}essentialdb.parquet"))
+
+def run(input_folder, output_folder, sparse):
+    presence.generate_presence_matrices_with_eval_resolution(str(input_folder), str(output_folder), sparse=sparse)
+    with open(output_folder / presence.RBH_CACHE_FOLDER / presence.MANIFEST_NAME) as fh:
+        return json.load(fh)["outputs"]
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_species_without_matches_left_gets_an_empty_matrix(tmp_path, sparse):
+    input_folder, output_folder = tmp_path / "tables", tmp_path / "out"
+    input_folder.mkdir()
+    write_blast_table(input_folder, "aa", "bb", [("aa1", "bb1")])
+    write_blast_table(input_folder, "bb", "aa", [("bb1", "aa1")])
+    layout = "pairs" if sparse else "matrix"
+    run(input_folder, output_folder, sparse)
+    assert table_io.read_presence_matrix(str(output_folder / f"aa_presence_{layout}.parquet")).loc["aa1", "bb"] == "bb1"
+
+    # aa has no hits in bb any more, so neither species keeps a reciprocal best hit
+    write_blast_table(input_folder, "aa", "bb", [])
+    outputs = run(input_folder, output_folder, sparse)
+    for species in ("aa", "bb"):
+        output_path = output_folder / f"{species}_presence_{layout}.parquet"
+        assert table_io.read_presence_matrix(str(output_path)).empty
+        assert outputs[species] == presence.get_output_entry(str(output_path))
+    assert sorted(os.listdir(output_folder)) == sorted(["hit_matrices", presence.RBH_CACHE_FOLDER, f"aa_presence_{layout}.parquet", f"bb_presence_{layout}.parquet"])
@@ -0,0 +1,46 @@
+# tests for merge2.py: the presence matrices of two species that are reciprocal best hits of each other must merge into one row
+# run with: python -m pytest test_merge2.py (from this folder)
+
+import pandas as pd
+import pytest
+
+import merge2
+# merge2 puts the repository root on sys.path
+from shared import table_io
+
+SPECIES = ["pneumo", "equi"]
+
+def write_matrices(folder, table_format, sparse):
+    """Writes the presence matrices of pneumo_g10 and equi_g10, each the other's match, as generate_all_presence_matrices_V2.py writes them."""
+    files = {}
+    for origin, target in (("pneumo", "equi"), ("equi", "pneumo")):
+        pairs = pd.DataFrame({"query id": [f"{origin}_g10"], "target": [target], "subject id": [f"{target}_g10"]})
+        if sparse:
+            files[origin] = str(folder / f"{origin}_presence_pairs.{table_format}")
+            table_io.write_table(pairs, files[origin])
+        else:
+            files[origin] = str(folder / f"{origin}_presence_matrix.{table_format}")
+            table_io.write_table(table_io.pairs_to_matrix(pairs), files[origin], index=True)
+    return files
+
+def merge(files, catalog=None):
+    clusters = merge2.OrthologClusters(SPECIES)
+    for origin, file in files.items():
+        clusters.add_rows(pd.DataFrame(merge2.read_matrix_rows((file, SPECIES, catalog, origin)), columns=SPECIES))
+    return clusters.to_frame()
+
+@pytest.mark.parametrize("table_format, sparse", [("parquet", False), ("feather", False), ("xlsx", False), ("parquet", True)])
+def test_mutual_hits_merge_into_one_row(tmp_path, table_format, sparse):
+    merged = merge(write_matrices(tmp_path, table_format, sparse))
+    assert merged.values.tolist() == [["pneumo_g10", "equi_g10"]]
+
+def test_mutual_hits_merge_into_one_row_from_catalog(tmp_path):
+    merged = merge(write_matrices(tmp_path, "parquet", False), catalog=str(tmp_path / "catalog.db"))
+    assert merged.values.tolist() == [["pneumo_g10", "equi_g10"]]
+
+def test_table_without_query_ids_is_kept_as_stored(tmp_path):
+    # no_results_all_species has no index, its rows are read as they are
+    no_results = str(tmp_path / "no_results_all_species.xlsx")
+    table_io.write_table(pd.DataFrame({"pneumo": ["pneumo_g20"], "equi": [None]}), no_results)
+    rows = merge2.read_matrix_rows((no_results, SPECIES, None, None))
+    assert len(rows) == 1 and rows[0][0] == "pneumo_g20" and pd.isna(rows[0][1])
@@ -1,73 +1,204 @@
-# input is a blastp result file, either .txt or .html
-# output is 3 .txt files
+# input is a folder of blastp result files (outfmt 7 .txt)
+# output is 3 .txt files per blast result file, plus blast_recap_summary.tsv with the counts of every file in the folder
 # generates recap .txt files of blastp runs:  genes that had hits,  genes without hits and a recap.txt showing numbers of each
+# files are read in a single streaming pass and processed in parallel (-w/--workers)
+# blast_recap_manifest.json in the folder records the size, mtime and sha256 of every processed file, so unchanged files are skipped on a rerun
 
 
 import os
+import sys
+import json
+import hashlib
 import argparse
 from collections import defaultdict
+from multiprocessing import Pool
+# the modules shared by the chapters are in shared/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared.locus_tag_index import LocusTagIndex
 
-def analyze_and_save_blast_results(file_path):
+MANIFEST_NAME = "blast_recap_manifest.json"
+SUMMARY_NAME = "blast_recap_summary.tsv"
+OUTPUT_SUFFIXES = ["_recap.txt", "_genes_with_hits.txt", "_genes_with_zero_hits.txt"]
+
+# Locus tag index of the worker process, loaded once by init_worker
+_tag_index = None
+
+def init_worker(tagindex):
+    global _tag_index
+    _tag_index = LocusTagIndex.load(tagindex) if tagindex else None
+
+def get_output_paths(file_path):
+    """The recap, hits and zero hits files written next to a blast result file."""
+    base = os.path.splitext(file_path)[0]
+    return [base + suffix for suffix in OUTPUT_SUFFIXES]
+
+def get_file_hash(file_path):
+    """sha256 of a file, read in 1 MiB blocks."""
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def is_blast_result(file_path):
+    """outfmt 7 files start with a '# BLASTP ...' style comment line, the recap outputs never do."""
+    with open(file_path, 'r') as fh:
+        return fh.readline().startswith('# BLAST')
+
+def analyze_and_save_blast_results(file_path, tag_index=None):
+    """Reads a blast result file in one streaming pass, writes its three recap files and returns its manifest entry (counts and sha256 included)."""
     gene_hits_info = defaultdict(list)
-    gene_no_hits = set()
+    # dict rather than set, so the zero hits file keeps the query order
+    gene_no_hits = {}
     base_name = os.path.splitext(os.path.basename(file_path))[0]
+    sha = hashlib.sha256()
+    total_hits = 0
+
+    with open(file_path, 'rb') as file:
+        for raw_line in file:
+            # The file is hashed in the same pass that parses it
+            sha.update(raw_line)
+            line = raw_line.decode()
+            if line.startswith('# Query:'):
+                current_gene = line.split('[locus_tag=')[-1].split(']')[0]
+                gene_name = line.split('[gene=')[-1].split(']')[0] if '[gene=' in line else ""
+                if gene_name == current_gene:  # No gene name found
+                    gene_name = ""  # Keep gene_name blank if not found
+                gene_no_hits[current_gene] = None  # Assume no hits initially
+            elif line.startswith('# 0 hits found'):
+                continue  # Skip processing for genes with no hits
+            elif not line.startswith('#') and line.strip():
+                parts = line.strip().split('\t')
+                if len(parts) > 1:
+                    subject_id = parts[1]
+                    gene_hits_info[current_gene].append((gene_name, current_gene, subject_id))
+                    total_hits += 1
+                    gene_no_hits.pop(current_gene, None)  # Remove from no hits if a hit is found
 
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-
-    for line in lines:
-        if line.startswith('# Query:'):
-            current_gene = line.split('[locus_tag=')[-1].split(']')[0]
-            gene_name = line.split('[gene=')[-1].split(']')[0] if '[gene=' in line else ""
-            if gene_name == current_gene:  # No gene name found
-                gene_name = ""  # Keep gene_name blank if not found
-            gene_no_hits.add(current_gene)  # Assume no hits initially
-        elif line.startswith('# 0 hits found'):
-            continue  # Skip processing for genes with no hits
-        elif not line.startswith('#') and line.strip():
-            parts = line.strip().split('\t')
-            if len(parts) > 1:
-                subject_id = parts[1]
-                gene_hits_info[current_gene].append((gene_name, current_gene, subject_id))
-                if current_gene in gene_no_hits:
-                    gene_no_hits.remove(current_gene)  # Remove from no hits if a hit is found
-
-    output_dir = os.path.dirname(file_path)
-    recap_path = os.path.join(output_dir, f"{base_name}_recap.txt")
-    hits_path = os.path.join(output_dir, f"{base_name}_genes_with_hits.txt")
-    zero_hits_path = os.path.join(output_dir, f"{base_name}_genes_with_zero_hits.txt")
+    recap_path, hits_path, zero_hits_path = get_output_paths(file_path)
 
     # Write detailed hits information
     with open(hits_path, 'w') as hits_file:
         for gene, hits in gene_hits_info.items():
             for hit in hits:
                 gene_name, locus_tag, subject_id = hit
-                hits_file.write(f"{gene_name}\t{locus_tag}\t{subject_id}\n")
+                if tag_index is not None:
+                    # Extra column with the PEPPAN tags of the query's locus tag
+                    hits_file.write(f"{gene_name}\t{locus_tag}\t{subject_id}\t{','.join(tag_index.new_tags(locus_tag))}\n")
+                else:
+                    hits_file.write(f"{gene_name}\t{locus_tag}\t{subject_id}\n")
 
     # Write genes with zero hits
     with open(zero_hits_path, 'w') as zero_hits_file:
         for gene in gene_no_hits:
             zero_hits_file.write(f"{gene}\n")
 
-    # Write recap content and print summary to the command line
+    # Write recap content
     recap_content = f"Total number of genes with one or more hits: {len(gene_hits_info)}\n" \
                     f"Total number of genes with zero hits: {len(gene_no_hits)}\n"
     with open(recap_path, 'w') as recap_file:
         recap_file.write(recap_content)
-    
-    print(f"Results for {base_name}:")
-    print(recap_content)
+
+    stat = os.stat(file_path)
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": sha.hexdigest(),
+        "genes_with_hits": len(gene_hits_info),
+        "genes_with_zero_hits": len(gene_no_hits),
+        "total_hits": total_hits,
+        "summary": f"Results for {base_name}:\n{recap_content}",
+    }
+
+def process_file(job):
+    """Process pool entry point: job is (file name, file path, tag index path)."""
+    file_name, file_path, tagindex = job
+    entry = analyze_and_save_blast_results(file_path, _tag_index)
+    entry["tagindex"] = tagindex
+    return file_name, entry
+
+def load_manifest(manifest_path):
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as fh:
+            return json.load(fh)
+    return {}
+
+def save_manifest(manifest, manifest_path):
+    # Written under a temporary name and renamed, so an interrupted run never leaves a half written manifest
+    # The pid in the temporary name keeps two runs sharing the folder from writing the same temporary file
+    temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+def is_unchanged(file_path, entry, tagindex):
+    """True if the file was processed with the same tag index and its outputs still exist. Size and mtime are checked first,
+    the file is only hashed when they differ (e.g. after a copy), and the manifest entry is refreshed if the content is the same."""
+    if not entry or entry.get("tagindex") != tagindex or not all(map(os.path.exists, get_output_paths(file_path))):
+        return False
+    stat = os.stat(file_path)
+    if (entry["size"], entry["mtime"]) == (stat.st_size, stat.st_mtime):
+        return True
+    if entry["size"] == stat.st_size and get_file_hash(file_path) == entry["sha256"]:
+        entry["mtime"] = stat.st_mtime
+        return True
+    return False
+
+def write_summary(manifest, summary_path):
+    """One row per blast result file in the folder, from the manifest, so skipped files are included."""
+    with open(summary_path, 'w') as summary_file:
+        summary_file.write("file\tgenes_with_hits\tgenes_with_zero_hits\ttotal_hits\n")
+        for file_name in sorted(manifest):
+            entry = manifest[file_name]
+            summary_file.write(f"{file_name}\t{entry['genes_with_hits']}\t{entry['genes_with_zero_hits']}\t{entry['total_hits']}\n")
 
 def main():
     parser = argparse.ArgumentParser(description="Analyze BLAST results and generate summary files.")
     parser.add_argument("-i", "--input_folder", type=str, required=True, help="Input folder containing BLAST result files.")
+    parser.add_argument("-t", "--tagindex", type=str, help="A locus tag index (<reference>_locus_tag_index.tsv from generate_unique_core_gene_tags.py). Adds the PEPPAN locus tags of each query as a fourth column of the genes_with_hits file.")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of files processed in parallel (default: 1).")
+    parser.add_argument("--force", action="store_true", help=f"Process every file, even those {MANIFEST_NAME} records as unchanged.")
 
     args = parser.parse_args()
+    tagindex = os.path.abspath(args.tagindex) if args.tagindex else None
+
+    manifest_path = os.path.join(args.input_folder, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+    # Blast result files are told apart from the recap outputs by their '# BLAST' first line
+    file_names = sorted(file_name for file_name in os.listdir(args.input_folder)
+                        if file_name.endswith('.txt') and is_blast_result(os.path.join(args.input_folder, file_name)))
+    # Files that are gone are dropped from the manifest and so from the summary
+    manifest = {file_name: entry for file_name, entry in manifest.items() if file_name in file_names}
+
+    jobs = []
+    for file_name in file_names:
+        file_path = os.path.join(args.input_folder, file_name)
+        if not args.force and is_unchanged(file_path, manifest.get(file_name), tagindex):
+            print(f"Skipping {file_name}, unchanged since the last run.")
+            continue
+        jobs.append((file_name, file_path, tagindex))
+
+    if args.workers > 1 and len(jobs) > 1:
+        pool = Pool(min(args.workers, len(jobs)), initializer=init_worker, initargs=(tagindex,))
+        results = pool.imap(process_file, jobs)
+    else:
+        pool = None
+        init_worker(tagindex)
+        results = map(process_file, jobs)
+    for file_name, entry in results:
+        # Print summary to the command line, and record the file as soon as it is done so an interrupted run keeps its progress
+        print(entry.pop("summary"))
+        manifest[file_name] = entry
+        save_manifest(manifest, manifest_path)
+    if pool:
+        pool.close()
+        pool.join()
 
-    for file_name in os.listdir(args.input_folder):
-        if file_name.endswith('.txt') and not any(substring in file_name for substring in ["_genes_with_hits", "_genes_with_zero_hits", "_recap"]):
-            file_path = os.path.join(args.input_folder, file_name)
-            analyze_and_save_blast_results(file_path)
+    save_manifest(manifest, manifest_path)
+    summary_path = os.path.join(args.input_folder, SUMMARY_NAME)
+    write_summary(manifest, summary_path)
+    print(f"Recap of {len(manifest)} files ({len(jobs)} processed, {len(file_names) - len(jobs)} unchanged) saved to {summary_path}")
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,28 @@
-#this scripts inputs are the essential gene spreadsheet "deduplicated_full_matrix.xlsx"
-# the output is a single spreadsheet showing the 62 superpangenome core and essential genes' tags for each species
+#this scripts inputs are the essential gene table "deduplicated_full_matrix" (.parquet, .feather or .xlsx)
+# the output is a single table (Parquet by default, --format xlsx for a spreadsheet) showing the 62 superpangenome core and essential genes' tags for each species
 # this script was used to get a list of the 62 superpangenome core and essential genes, which could then be extracted from any of the species by using it as a keyfile for fastafinder_v2.py
+# the species columns come from species_registry.json
 
-import pandas as pd
+import argparse
+import os
+import sys
+# the modules shared by the chapters are in shared/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import species_registry, table_io
 
-# Load the combined matrix
-df = pd.read_excel("deduplicated_full_matrix.xlsx")
+parser = argparse.ArgumentParser(description="Extract the genes present in every species column of the deduplicated_full_matrix table.")
+species_registry.add_registry_argument(parser)
+table_io.add_format_argument(parser)
+args = parser.parse_args()
 
-# Specify the columns in the order you want (each as a species)
-species_columns = ['equi', 'iniae', 'uberis', 'pneumo', 'suis', 'agal']
+# The columns in registry order (each as a species)
+species_columns = species_registry.get_species_keys(species_registry.load_registry(args.registry))
+
+# Load the species columns of the combined matrix
+matrix_file = table_io.find_table("deduplicated_full_matrix")
+if matrix_file is None:
+    sys.exit("No .parquet, .feather or .xlsx table found for deduplicated_full_matrix, run merge2.py first")
+df = table_io.read_table(matrix_file, columns=species_columns)
 
 # Filter to rows where every species column is filled (not NaN and not blank)
 core_rows = df.dropna(subset=species_columns)
@@ -17,7 +31,8 @@ core_rows = core_rows[core_rows.apply(lambda row: all(str(row[c]).strip() != ""
 # Drop duplicate ortholog groups if any (shouldn't happen, but just in case)
 core_rows = core_rows.drop_duplicates(subset=species_columns)
 
-# Save as Excel file, each column = species, each row = gene
-core_rows[species_columns].to_excel("core_orthologous_groups_all_6_species.xlsx", index=False)
+# Save as a table, each column = species, each row = gene
+output_path = f"core_orthologous_groups_all_6_species.{table_io.get_output_format(args.format)}"
+table_io.write_table(core_rows[species_columns], output_path)
 
-print(f"Saved {len(core_rows)} core groups to all_essential.xlsx")
+print(f"Saved {len(core_rows)} core groups to {output_path}")
@@ -0,0 +1,3 @@
+# modules shared by the chapter 2, 3 and 4 scripts, kept in one place instead of a copy per chapter folder
+# the chapter scripts put the repository root on sys.path and import them as `from shared import table_io`
+# the FASTA tools (fastafetcher_V2.py, pancat_parser.py, dna_to_aa_converter.py) and gene_catalog.py are run from here, e.g. python shared/fastafetcher_V2.py -h
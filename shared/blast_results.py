@@ -0,0 +1,156 @@
+# parsing of BLAST outfmt 7 result files (.txt), shared by blast_to_spreadsheet.py and gene_catalog.py
+# the results are streamed line by line into typed columns (Int32 lengths and coordinates, float64 evalues), and every query row records its '# N hits found' count
+# top_k keeps only the best hits of each query and min_qcov/min_identity drop weak hits while the file is read, so the frames never hold the rest
+
+import heapq
+import re
+
+import pandas as pd
+
+fields = ['query id', 'subject id', 'alignment length', 'query length', 'subject length', 'q. start', 'q. end', 's. start', 's. end', 'evalue']
+
+# Column types of the numeric outfmt 7 fields, any other field is kept as text
+FIELD_TYPES = {
+    'Hits found': 'Int32',
+    'alignment length': 'Int32', 'query length': 'Int32', 'subject length': 'Int32',
+    'q. start': 'Int32', 'q. end': 'Int32', 's. start': 'Int32', 's. end': 'Int32',
+    'mismatches': 'Int32', 'gap opens': 'Int32', 'gaps': 'Int32', 'identical': 'Int32', 'positives': 'Int32', 'score': 'Int32',
+    'evalue': 'float64', 'bit score': 'float64', '% identity': 'float64', '% positives': 'float64',
+    '% query coverage per subject': 'float64', '% query coverage per hsp': 'float64', '% query coverage per uniq subject': 'float64',
+}
+
+HITS_FOUND_RE = re.compile(r'# (\d+) hits found')
+
+def make_blast_frame(rows, row_fields):
+    """Turns rows of [Query, Database, Hits found, *field values] into a DataFrame with typed columns.
+    Integer fields become nullable Int32 and real valued fields float64, so a missing value (a query without hits) is NA instead of ''."""
+    columns = ['Query', 'Database', 'Hits found'] + row_fields
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    df = pd.DataFrame({column: pd.Series(column_values, dtype=object) for column, column_values in zip(columns, values)})
+    for column in columns:
+        column_type = FIELD_TYPES.get(column)
+        if column_type:
+            df[column] = pd.to_numeric(df[column]).astype(column_type)
+    return df
+
+def get_field_value(values, file_fields, field, default=None):
+    """A hit's value of an outfmt 7 field as a float, or default when the field is missing or empty."""
+    if field not in file_fields:
+        return default
+    value = values[file_fields.index(field)]
+    return float(value) if value not in (None, '') else default
+
+def get_query_coverage(values, file_fields):
+    """Percentage of the query covered by the hit, from its q. start, q. end and query length."""
+    q_start = get_field_value(values, file_fields, 'q. start')
+    q_end = get_field_value(values, file_fields, 'q. end')
+    query_length = get_field_value(values, file_fields, 'query length')
+    return (abs(q_end - q_start) + 1) / query_length * 100
+
+def get_identity(values, file_fields):
+    """Percentage identity of the hit, from the '% identity' field or from identical / alignment length."""
+    if '% identity' in file_fields:
+        return get_field_value(values, file_fields, '% identity')
+    return get_field_value(values, file_fields, 'identical') / get_field_value(values, file_fields, 'alignment length') * 100
+
+def check_hit_fields(file_fields, min_qcov, min_identity):
+    """Raises ValueError when a threshold needs fields the blast results do not have."""
+    if min_qcov is not None and not {'q. start', 'q. end', 'query length'} <= set(file_fields):
+        raise ValueError("--min-qcov needs the 'q. start', 'q. end' and 'query length' fields")
+    if min_identity is not None and '% identity' not in file_fields and not {'identical', 'alignment length'} <= set(file_fields):
+        raise ValueError("--min-identity needs the '% identity' field, or the 'identical' and 'alignment length' fields")
+
+def keep_hit(values, file_fields, min_qcov, min_identity):
+    """True if the hit passes the query coverage and identity thresholds (percentages, None for no threshold)."""
+    if min_qcov is not None and get_query_coverage(values, file_fields) < min_qcov:
+        return False
+    if min_identity is not None and get_identity(values, file_fields) < min_identity:
+        return False
+    return True
+
+def push_hit(heap, values, file_fields, order, top_k):
+    """Adds a hit to the heap of a query's best hits, dropping the worst one once it holds top_k hits.
+    The heap is ordered worst first: highest evalue, then lowest bit score, then latest in the file."""
+    evalue = get_field_value(values, file_fields, 'evalue', float('inf'))
+    bit_score = get_field_value(values, file_fields, 'bit score', 0.0)
+    entry = (-evalue, bit_score, -order, values)
+    if top_k is None or len(heap) < top_k:
+        heapq.heappush(heap, entry)
+    elif entry[:3] > heap[0][:3]:
+        heapq.heapreplace(heap, entry)
+
+def get_query_rows(query, heap, passed, file_fields):
+    """Rows of a query's kept hits in file order, or a single row without hits when none passed the thresholds. query is (query id, database)."""
+    if not heap:
+        return [[query[0], query[1], 0] + [None] * len(file_fields)]
+    return [[query[0], query[1], passed] + entry[3] for entry in sorted(heap, key=lambda entry: -entry[2])]
+
+# Stream BLAST results line by line, yielding typed DataFrame chunks
+def iter_blast_chunks(file_path, chunk_size=100000, top_k=None, min_qcov=None, min_identity=None):
+    """top_k keeps only the best hits of each query (lowest evalue, then highest bit score), min_qcov and min_identity drop the hits
+    below a query coverage or identity percentage first. With either, 'Hits found' counts the hits passing the thresholds
+    and a query whose hits all fail them gets a row without hits; the kept hits stay in file order."""
+    reduce_hits = top_k is not None or min_qcov is not None or min_identity is not None
+    current_query = current_database = None
+    hits_found = 0
+    # The pipeline's fields are assumed until a '# Fields:' line says otherwise
+    file_fields = fields
+    rows = []
+    # Hits of the query being read when reducing: the heap of its best hits and the number passing the thresholds
+    heap = []
+    passed = 0
+    pending = None
+    with open(file_path, 'r') as file:
+        for line in file:
+            line = line.rstrip('\n')
+            if line.startswith('#') and pending:
+                # The hits of a query end at the next comment line
+                rows.extend(get_query_rows(pending, heap, passed, file_fields))
+                heap = []
+                passed = 0
+                pending = None
+            if line.startswith('# Query:'):
+                current_query = line.split()[2]
+            elif line.startswith('# Database:'):
+                current_database = line.split(': ')[1]
+            elif line.startswith('# Fields:'):
+                line_fields = line[len('# Fields:'):].strip().split(', ')
+                if line_fields != file_fields:
+                    # Rows already read keep the columns they were read with
+                    if rows:
+                        yield make_blast_frame(rows, file_fields)
+                        rows = []
+                    file_fields = line_fields
+                if reduce_hits:
+                    check_hit_fields(file_fields, min_qcov, min_identity)
+            elif HITS_FOUND_RE.match(line):
+                # Every hit row of the query carries the query's hit count
+                hits_found = int(HITS_FOUND_RE.match(line).group(1))
+                if hits_found == 0:
+                    rows.append([current_query, current_database, 0] + [None] * len(file_fields))
+                elif reduce_hits:
+                    pending = (current_query, current_database)
+            elif not line.startswith('#'):
+                hit_values = line.split('\t')
+                if len(hit_values) > 1:
+                    values = (hit_values + [None] * len(file_fields))[:len(file_fields)]
+                    if reduce_hits:
+                        if keep_hit(values, file_fields, min_qcov, min_identity):
+                            passed += 1
+                            push_hit(heap, values, file_fields, passed, top_k)
+                        continue
+                    rows.append([current_query, current_database, hits_found] + values)
+            if len(rows) >= chunk_size:
+                yield make_blast_frame(rows, file_fields)
+                rows = []
+    if pending:
+        rows.extend(get_query_rows(pending, heap, passed, file_fields))
+    if rows:
+        yield make_blast_frame(rows, file_fields)
+
+# Process BLAST results and create a DataFrame
+def process_blast_results(file_path, top_k=None, min_qcov=None, min_identity=None):
+    chunks = list(iter_blast_chunks(file_path, top_k=top_k, min_qcov=min_qcov, min_identity=min_identity))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
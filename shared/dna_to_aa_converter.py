@@ -0,0 +1,169 @@
+
+# input is a nucleotide fasta or multifasta file .fna
+# output is a n amino acid fasta file .faa
+# this script translates nucleotide sequences to amino acid sequences (used in chapters 2, 3 and 4)
+
+import argparse
+import os
+import sys
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+from Bio import SeqIO
+from Bio.Data import CodonTable
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+# the repository root, so shared/ imports as a package when this file is run as a script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared.fasta_reader import iter_records
+
+# optional deps (graceful fallback)
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except Exception:
+    HAVE_NUMPY = False
+
+STOP = ord("*")
+# Per process cache of codon lookup tables, keyed by NCBI table id
+_codon_luts = {}
+
+def get_codon_lut(table_id):
+    """Builds a 64 entry lookup table from codon index (16*first + 4*second + third, bases in TCAG order) to amino acid byte."""
+    if table_id not in _codon_luts:
+        table = CodonTable.unambiguous_dna_by_id[table_id]
+        bases = "TCAG"
+        lut = np.empty(64, dtype=np.uint8)
+        for i, first in enumerate(bases):
+            for j, second in enumerate(bases):
+                for k, third in enumerate(bases):
+                    lut[16 * i + 4 * j + k] = ord(table.forward_table.get(first + second + third, "*"))
+        _codon_luts[table_id] = lut
+    return _codon_luts[table_id]
+
+if HAVE_NUMPY:
+    # Maps a nucleotide byte to 0-3 (TCAG, either case), anything else to 4
+    BASE_CODES = np.full(256, 4, dtype=np.uint8)
+    for code, base in enumerate(b"TCAG"):
+        BASE_CODES[base] = code
+        BASE_CODES[base + 32] = code
+
+def flag_internal_stops(protein):
+    """Drops a terminal stop from a full translation and reports whether any stop is left inside it. Returns (protein, has internal stop)."""
+    if protein.endswith("*"):
+        protein = protein[:-1]
+    return protein, "*" in protein
+
+def translate_batch_biopython(batch, table_id, to_stop):
+    """Translates a batch of (id, DNA bytes) record by record with Biopython."""
+    results = []
+    for rec_id, dna in batch:
+        if to_stop:
+            results.append((rec_id, str(Seq(dna.decode()).translate(table=table_id, to_stop=True)), False))
+        else:
+            results.append((rec_id, *flag_internal_stops(str(Seq(dna.decode()).translate(table=table_id)))))
+    return results
+
+def translate_batch_numpy(batch, table_id, to_stop):
+    """Translates a batch of (id, DNA bytes) with one vectorised codon table lookup over the whole batch.
+    Records containing anything other than ACGT go through Biopython so ambiguity codes translate exactly as before."""
+    lut = get_codon_lut(table_id)
+    # Trailing partial codons are dropped, as Biopython does, so every record starts on a codon boundary
+    codon_counts = np.fromiter((len(dna) // 3 for _, dna in batch), dtype=np.int64, count=len(batch))
+    bounds = np.zeros(len(batch) + 1, dtype=np.int64)
+    np.cumsum(codon_counts, out=bounds[1:])
+    joined = b"".join(dna[:3 * n] for (_, dna), n in zip(batch, codon_counts))
+    codons = BASE_CODES[np.frombuffer(joined, dtype=np.uint8)].reshape(-1, 3)
+    amino_acids = lut[(codons[:, 0] * 16 + codons[:, 1] * 4 + codons[:, 2]) & 63]
+    # Records with any non ACGT base in a codon
+    bad_codons = np.zeros(len(codons) + 1, dtype=np.int64)
+    np.cumsum((codons > 3).any(axis=1), out=bad_codons[1:])
+    has_bad_base = bad_codons[bounds[1:]] > bad_codons[bounds[:-1]]
+    # The first stop codon at or after the start of each record
+    stop_positions = np.append(np.flatnonzero(amino_acids == STOP), len(amino_acids))
+    first_stops = stop_positions[np.searchsorted(stop_positions, bounds[:-1])]
+    protein_bytes = amino_acids.tobytes()
+
+    results = []
+    for n, (rec_id, dna) in enumerate(batch):
+        if has_bad_base[n]:
+            results.extend(translate_batch_biopython([(rec_id, dna)], table_id, to_stop))
+            continue
+        start, end = bounds[n], bounds[n + 1]
+        if to_stop:
+            results.append((rec_id, protein_bytes[start:min(first_stops[n], end)].decode(), False))
+        else:
+            results.append((rec_id, *flag_internal_stops(protein_bytes[start:end].decode())))
+    return results
+
+def translate_batch(job):
+    """Process pool entry point: job is (engine, batch, table id, to_stop)."""
+    engine, batch, table_id, to_stop = job
+    if engine == "numpy":
+        return translate_batch_numpy(batch, table_id, to_stop)
+    return translate_batch_biopython(batch, table_id, to_stop)
+
+def iter_batches(input_file, batch_size):
+    """Yields lists of (id, DNA bytes) from the input file, batch_size records at a time."""
+    records = ((rec.id, rec.sequence_bytes()) for rec in iter_records(input_file))
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def iter_protein_records(input_file, table_id=1, to_stop=True, engine="numpy", threads=1, batch_size=10000):
+    """Translates each DNA sequence in the input file, yielding protein SeqRecords in input order.
+    Batches are spread over a process pool when threads > 1."""
+    if engine == "numpy" and not HAVE_NUMPY:
+        sys.stderr.write("numpy is not installed, falling back to the biopython translation engine.\n")
+        engine = "biopython"
+    jobs = ((engine, batch, table_id, to_stop) for batch in iter_batches(input_file, batch_size))
+    if threads > 1:
+        with Pool(threads) as pool:
+            # At most threads * 2 batches are in flight, collected in submission order, which is input order
+            pending = deque(pool.apply_async(translate_batch, (job,)) for job in islice(jobs, threads * 2))
+            while pending:
+                results = pending.popleft().get()
+                for job in islice(jobs, 1):
+                    pending.append(pool.apply_async(translate_batch, (job,)))
+                yield from make_protein_records(results)
+    else:
+        for job in jobs:
+            yield from make_protein_records(translate_batch(job))
+
+def make_protein_records(results):
+    """Turns (id, protein, has internal stop) tuples into SeqRecords."""
+    for rec_id, protein, internal_stop in results:
+        description = "translated protein internal_stop" if internal_stop else "translated protein"
+        yield SeqRecord(Seq(protein), id=rec_id, description=description)
+
+def translate_dna_to_protein(input_file, output_file, stream=False, buffer_size=1024 * 1024, table_id=1, to_stop=True, engine="numpy", threads=1, batch_size=10000):
+    protein_records = iter_protein_records(input_file, table_id, to_stop, engine, threads, batch_size)
+    if stream:
+        # Write each protein record as soon as it is translated, memory stays bounded by the write buffer
+        with open(output_file, "w", buffering=buffer_size) as out_fh:
+            SeqIO.write(protein_records, out_fh, "fasta")
+    else:
+        # List to hold the translated protein sequences
+        protein_sequences = list(protein_records)
+
+        # Write the protein sequences to the output file
+        SeqIO.write(protein_sequences, output_file, "fasta")
+    print(f"Protein sequences have been written to {output_file}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Translate DNA sequences in a multi-FASTA file to protein sequences.")
+    parser.add_argument("-i", "--input", required=True, help="Path to the input multi-FASTA file containing DNA sequences.")
+    parser.add_argument("-o", "--output", required=True, help="Path to the output FASTA file to save translated protein sequences.")
+    parser.add_argument("--stream", action="store_true", help="Write each protein sequence as soon as it is translated instead of holding them all in memory.")
+    parser.add_argument("-b", "--buffer-size", type=int, default=1024 * 1024, help="Write buffer size in bytes for --stream (default: 1 MiB).")
+    parser.add_argument("-t", "--table", type=int, default=1, choices=sorted(CodonTable.unambiguous_dna_by_id), help="NCBI translation table id (default: 1, the standard code; 11 is the bacterial code).")
+    parser.add_argument("--internal-stops", choices=["truncate", "flag"], default="truncate", help="truncate: stop translating at the first stop codon (default). flag: translate through stop codons, dropping a terminal one, and mark proteins with internal stops as 'internal_stop' in their description.")
+    parser.add_argument("--engine", choices=["numpy", "biopython"], default="numpy", help="Translate with vectorised numpy codon lookups (default) or record by record with Biopython.")
+    parser.add_argument("--threads", type=int, default=1, help="Number of worker processes to translate batches on (default: 1).")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Number of sequences translated per batch (default: 10000).")
+
+    args = parser.parse_args()
+
+    translate_dna_to_protein(args.input, args.output, args.stream, args.buffer_size, args.table, args.internal_stops == "truncate", args.engine, args.threads, args.batch_size)
@@ -0,0 +1,285 @@
+# memory-mapped FASTA reader shared by fastafetcher_V2.py, pancat_parser.py and dna_to_aa_converter.py
+# records are slices of the mapped file, headers and sequences are only turned into strings when asked for
+# this keeps parsing of multi-GB allele files close to the speed of a plain byte scan
+# BGZF (bgzip) compressed files are read too: full scans inflate blocks in parallel, and a .gzi block index
+# lets offset lookups inflate only the blocks that hold the requested records
+
+import io
+import mmap
+import os
+import struct
+import zlib
+from bisect import bisect_right
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+GZIP_MAGIC = b"\x1f\x8b"
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+
+class FastaRecord:
+    """One record of a multifasta. header, raw_sequence and raw are memoryview slices of the file, nothing is copied.
+    view holds the file, or a decompressed stretch of it starting at file position base."""
+    __slots__ = ("view", "start", "header_end", "end", "base", "_title", "_id")
+
+    def __init__(self, view, start, header_end, end, base=0):
+        self.view = view
+        self.start = start
+        self.header_end = header_end
+        self.end = end
+        self.base = base
+        self._title = None
+        self._id = None
+
+    @property
+    def offset(self):
+        """Byte offset of the record in the (uncompressed) file."""
+        return self.base + self.start
+
+    @property
+    def length(self):
+        """Length of the whole record in bytes, header line included."""
+        return self.end - self.start
+
+    @property
+    def header(self):
+        """The header line without the leading '>' or the newline."""
+        return self.view[self.start + 1:self.header_end]
+
+    @property
+    def raw_sequence(self):
+        """The sequence lines as stored in the file, newlines included."""
+        return self.view[min(self.header_end + 1, self.end):self.end]
+
+    @property
+    def raw(self):
+        """The whole record exactly as stored in the file."""
+        return self.view[self.start:self.end]
+
+    @property
+    def description(self):
+        """The header as SeqIO reports it in rec.description."""
+        if self._title is None:
+            self._title = bytes(self.header).rstrip().decode()
+        return self._title
+
+    @property
+    def id(self):
+        """Same ID rule as SeqIO: the header up to the first whitespace."""
+        if self._id is None:
+            parts = self.description.split(None, 1)
+            self._id = parts[0] if parts else ""
+        return self._id
+
+    def sequence_bytes(self):
+        """The sequence with line breaks and spaces removed."""
+        return bytes(self.raw_sequence).translate(None, b" \r\n")
+
+    def sequence(self):
+        """The sequence as a string."""
+        return self.sequence_bytes().decode()
+
+    def format_fasta(self, wrap=60):
+        """The record as SeqIO.write would write it: the header, then the sequence wrapped at 60 characters."""
+        sequence = self.sequence()
+        lines = [f">{self.description}\n"]
+        lines.extend(sequence[i:i + wrap] + "\n" for i in range(0, len(sequence), wrap))
+        return "".join(lines)
+
+def is_bgzf(path):
+    """True if the file is BGZF compressed. Plain gzip cannot be read by offset, so it is rejected with a clear message."""
+    with open(path, "rb") as fh:
+        head = fh.read(14)
+    if head[:4] == BGZF_MAGIC and head[12:14] == b"BC":
+        return True
+    if head[:2] == GZIP_MAGIC:
+        raise ValueError(f"{path} is gzip compressed but not BGZF. Recompress it with `bgzip` to read it directly.")
+    return False
+
+def map_file(path):
+    """Memory maps a file read-only. An empty file cannot be mapped, so it is returned as empty bytes instead."""
+    if os.path.getsize(path) == 0:
+        return b""
+    with open(path, "rb") as fh:
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+def find_record_start(data, pos):
+    """Returns the offset of the first record starting at or after pos, or the file size if there is none."""
+    if pos == 0 and data[:1] == b">":
+        return 0
+    found = data.find(b"\n>", max(pos - 1, 0))
+    return found + 1 if found != -1 else len(data)
+
+def split_records(data, start, end, base=0):
+    """Yields a FastaRecord for every record starting in [start, end) of data, which holds the file from position base."""
+    view = memoryview(data)
+    size = len(data)
+    rec_start = find_record_start(data, start)
+    while rec_start < end:
+        header_end = data.find(b"\n", rec_start)
+        if header_end == -1:
+            header_end = size
+        next_start = data.find(b"\n>", header_end)
+        rec_end = next_start + 1 if next_start != -1 else size
+        yield FastaRecord(view, rec_start, header_end, rec_end, base)
+        rec_start = rec_end
+
+def iter_records(path, start=0, end=None, data=None, threads=1):
+    """Yields a FastaRecord for every record starting in the byte range [start, end) of the file, in file order.
+    Anything before the first '>' is skipped, as SeqIO does. BGZF files are read whole, inflating blocks on threads processes."""
+    if data is None:
+        if is_bgzf(path):
+            return iter_stream_records(iter_bgzf_data(path, threads))
+        data = map_file(path)
+    if end is None or end > len(data):
+        end = len(data)
+    return split_records(data, start, end)
+
+def iter_stream_records(chunks):
+    """Yields FastaRecords from consecutive chunks of a decompressed file. Only the record running over a chunk boundary is carried over."""
+    pending = b""
+    # File position of pending[0]
+    base = 0
+    for chunk in chunks:
+        data = pending + chunk if pending else chunk
+        # Records before the last record start are complete, the last one waits for the next chunk
+        last_start = data.rfind(b"\n>") + 1
+        if last_start:
+            yield from split_records(data, 0, last_start, base)
+            pending = data[last_start:]
+            base += last_start
+        else:
+            pending = data
+    if pending:
+        yield from split_records(pending, 0, len(pending), base)
+
+def read_records_at(path, locations):
+    """Yields the FastaRecords at the given (offset, length) locations, in the order given."""
+    if is_bgzf(path):
+        yield from read_bgzf_records_at(path, locations)
+        return
+    data = map_file(path)
+    view = memoryview(data)
+    for offset, length in locations:
+        end = offset + length
+        header_end = data.find(b"\n", offset, end)
+        yield FastaRecord(view, offset, header_end if header_end != -1 else end, end)
+
+def iter_bgzf_blocks(fh):
+    """Walks the BGZF blocks of an open file, yielding (compressed offset, whole compressed block)."""
+    offset = 0
+    while True:
+        header = fh.read(12)
+        if len(header) < 12:
+            return
+        xlen = struct.unpack("<H", header[10:12])[0]
+        extra = fh.read(xlen)
+        # BSIZE, the total block size minus one, is kept in the BC extra subfield
+        bsize = None
+        pos = 0
+        while pos + 4 <= len(extra):
+            subfield_length = struct.unpack("<H", extra[pos + 2:pos + 4])[0]
+            if extra[pos:pos + 2] == b"BC":
+                bsize = struct.unpack("<H", extra[pos + 4:pos + 6])[0]
+            pos += 4 + subfield_length
+        if bsize is None:
+            raise ValueError(f"Block at offset {offset} is not a BGZF block.")
+        yield offset, header + extra + fh.read(bsize + 1 - 12 - xlen)
+        offset += bsize + 1
+
+def inflate_block(block):
+    """Decompresses one whole BGZF block."""
+    xlen = struct.unpack("<H", block[10:12])[0]
+    return zlib.decompress(block[12 + xlen:-8], -15)
+
+def iter_bgzf_data(path, threads=1):
+    """Yields the decompressed contents of a BGZF file block by block, in order. Blocks are inflated in parallel when threads > 1."""
+    with open(path, "rb") as fh:
+        blocks = (block for offset, block in iter_bgzf_blocks(fh))
+        if threads > 1:
+            with Pool(threads) as pool:
+                # At most threads * 2 blocks are in flight, collected in submission order, which is file order
+                pending = deque(pool.apply_async(inflate_block, (block,)) for block in islice(blocks, threads * 2))
+                while pending:
+                    data = pending.popleft().get()
+                    for block in islice(blocks, 1):
+                        pending.append(pool.apply_async(inflate_block, (block,)))
+                    yield data
+        else:
+            yield from map(inflate_block, blocks)
+
+def get_block_index_path(path):
+    """The block index uses the same name and layout as `bgzip -i`, so an existing .gzi is reused."""
+    return path + ".gzi"
+
+def build_block_index(path):
+    """Reads the block headers and sizes only (no decompression) and returns the (compressed, uncompressed) offset of every block."""
+    index = []
+    uncompressed_offset = 0
+    with open(path, "rb") as fh:
+        for offset, block in iter_bgzf_blocks(fh):
+            index.append((offset, uncompressed_offset))
+            # ISIZE, the uncompressed size of the block, is the last 4 bytes
+            uncompressed_offset += struct.unpack("<I", block[-4:])[0]
+    return index
+
+def read_block_index(index_file):
+    """Reads a .gzi: a uint64 count followed by (compressed, uncompressed) uint64 pairs, with the first block at (0, 0) left out.
+    Returns None when the file is shorter than its count says, so a truncated index is rebuilt rather than trusted."""
+    with open(index_file, "rb") as ifh:
+        header = ifh.read(8)
+        if len(header) < 8:
+            return None
+        count = struct.unpack("<Q", header)[0]
+        data = ifh.read(16 * count)
+    if len(data) < 16 * count:
+        return None
+    pairs = struct.unpack(f"<{2 * count}Q", data)
+    return [(0, 0)] + list(zip(pairs[0::2], pairs[1::2]))
+
+def get_block_index(path):
+    """Loads the .gzi block index, building and saving it first if it is missing, truncated or older than the file.
+    The .gzi is written under a temporary name and renamed, so a concurrent reader never sees it half written."""
+    index_file = get_block_index_path(path)
+    if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(path):
+        index = read_block_index(index_file)
+        if index is not None:
+            return index
+    index = build_block_index(path)
+    temp_file = f"{index_file}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, "wb") as ifh:
+            ifh.write(struct.pack("<Q", len(index) - 1))
+            for compressed_offset, uncompressed_offset in index[1:]:
+                ifh.write(struct.pack("<QQ", compressed_offset, uncompressed_offset))
+        os.replace(temp_file, index_file)
+    except OSError:
+        # A read-only folder only means the index is rebuilt next time
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    return index
+
+def read_bgzf_records_at(path, locations):
+    """Yields the FastaRecords at (uncompressed offset, length) locations, inflating only the blocks that hold them.
+    The last inflated stretch is kept, so records sharing blocks (e.g. sorted lookups) do not inflate them twice."""
+    index = get_block_index(path)
+    uncompressed_starts = [uncompressed_offset for compressed_offset, uncompressed_offset in index]
+    file_size = os.path.getsize(path)
+    cached_blocks = None
+    data = b""
+    base = 0
+    with open(path, "rb") as fh:
+        for offset, length in locations:
+            first = bisect_right(uncompressed_starts, offset) - 1
+            last = bisect_right(uncompressed_starts, offset + max(length, 1) - 1) - 1
+            if cached_blocks is None or not (cached_blocks[0] <= first and last <= cached_blocks[1]):
+                fh.seek(index[first][0])
+                compressed_end = index[last + 1][0] if last + 1 < len(index) else file_size
+                compressed = io.BytesIO(fh.read(compressed_end - index[first][0]))
+                data = b"".join(inflate_block(block) for _, block in iter_bgzf_blocks(compressed))
+                base = index[first][1]
+                cached_blocks = (first, last)
+            start = offset - base
+            end = start + length
+            header_end = data.find(b"\n", start, end)
+            yield FastaRecord(memoryview(data), start, header_end if header_end != -1 else end, end, base)
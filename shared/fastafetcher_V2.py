@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+
+# Extract fasta files by their descriptors stored in a separate file.
+# Requires fasta_reader.py from this folder. Used by the chapter 2 and chapter 4 workflows.
+# use -h flag for use.
+
+# TODO:
+# - Create more sophisticated logic for matching IDs/Descriptions/Partial matches etc.
+#    - Create a mode variable to encapsulate invert/partial/description/id etc?
+from collections import Counter, deque
+from itertools import islice
+from multiprocessing import Pool
+import os
+import sys
+import argparse
+# the repository root, so shared/ imports as a package when this file is run as a script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared.fasta_reader import is_bgzf, iter_records, read_records_at
+from shared.locus_tag_index import LocusTagIndex
+
+# optional deps (graceful fallback)
+try:
+    import ahocorasick
+    HAVE_AHOCORASICK = True
+except Exception:
+    HAVE_AHOCORASICK = False
+
+def read_keyfile(keyfile):
+    """Turns a key file into a list. May be memory intensive."""
+    with open(keyfile, "r") as kfh:
+        keys = [line.rstrip("\n").lstrip(">") for line in kfh]
+    return keys
+
+def get_keys(args):
+    """Turns the input key file into a list. May be memory intensive."""
+    return read_keyfile(args.keyfile)
+
+def read_manifest(manifest):
+    """Reads batch jobs from a tab separated manifest, one job per line:
+    keyfile, outfile, method (exact/partial), invert (yes/no) and an optional keys-not-found file.
+    Blank lines and lines starting with # are skipped."""
+    jobs = []
+    with open(manifest, "r") as mfh:
+        for line_number, line in enumerate(mfh, start=1):
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 4 or fields[2] not in ("exact", "partial"):
+                sys.stderr.write(f"Malformed manifest line {line_number} in {manifest}, expected keyfile, outfile, exact/partial, invert. Exiting.")
+                sys.exit(1)
+            keyfile, outfile, method, invert = fields[:4]
+            keysnotfound = fields[4] if len(fields) > 4 and fields[4] else os.path.splitext(outfile)[0] + "_keys_not_found.txt"
+            jobs.append({
+                "keyfile": keyfile,
+                "outfile": outfile,
+                "method": method,
+                "invert": invert.strip().lower() in ("yes", "y", "true", "1", "invert"),
+                "keysnotfound": keysnotfound,
+            })
+    return jobs
+
+def get_index_path(fasta):
+    """The on-disk offset index lives next to the multifasta it describes."""
+    return fasta + ".fetchidx"
+
+def build_index(fasta, index_file, threads=1):
+    """Scans the multifasta once and records the byte offset and length of every record under its ID, returning the index.
+    The first line stores the size and mtime of the multifasta so a stale index can be detected.
+    For BGZF files the offsets are into the uncompressed data, and the .gzi block index maps them to blocks.
+    The file is written under a temporary name and renamed, so a concurrent run never loads it half written;
+    when it cannot be written (e.g. read-only storage) the index is only kept in memory for this run."""
+    stat = os.stat(fasta)
+    index = {}
+    for rec in iter_records(fasta, threads=threads):
+        index.setdefault(rec.id, []).append((rec.offset, rec.length))
+    temp_file = f"{index_file}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, "w") as ifh:
+            ifh.write(f"#size={stat.st_size}\tmtime={stat.st_mtime_ns}\n")
+            for rec_id, locations in index.items():
+                for offset, length in locations:
+                    ifh.write(f"{rec_id}\t{offset}\t{length}\n")
+        os.replace(temp_file, index_file)
+    except OSError as error:
+        sys.stderr.write(f"Could not save offset index {index_file} ({error}), keeping it in memory.\n")
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    return index
+
+def load_index(fasta, index_file):
+    """Reads the offset index into a dict of ID -> [(offset, length), ...]. Returns None if the index is missing or stale."""
+    if not os.path.exists(index_file):
+        return None
+    stat = os.stat(fasta)
+    index = {}
+    with open(index_file, "r") as ifh:
+        if ifh.readline().rstrip("\n") != f"#size={stat.st_size}\tmtime={stat.st_mtime_ns}":
+            return None
+        for line in ifh:
+            rec_id, offset, length = line.rstrip("\n").split("\t")
+            index.setdefault(rec_id, []).append((int(offset), int(length)))
+    return index
+
+def get_index(fasta, threads=1):
+    """Loads the offset index for the multifasta, (re)building it first if it is missing or out of date."""
+    index_file = get_index_path(fasta)
+    index = load_index(fasta, index_file)
+    if index is None:
+        sys.stderr.write(f"Building offset index {index_file}...\n")
+        index = build_index(fasta, index_file, threads)
+    return index
+
+def fetch_indexed(fasta, index, keys):
+    """Jumps straight to the records for the given IDs and yields them in file order."""
+    locations = sorted(loc for key in set(keys) for loc in index.get(key, []))
+    return read_records_at(fasta, locations)
+
+class KeyMatcher:
+    """Aho-Corasick automaton built once from the keys, so each header is scanned once no matter how many keys there are.
+    Uses pyahocorasick when it is installed and a pure python automaton otherwise."""
+
+    def __init__(self, keys):
+        patterns = list(dict.fromkeys(key for key in keys if key))
+        # An empty key is a substring of every header, as it is with `key in rec.description`
+        self.always = [""] if "" in keys else []
+        self.automaton = None
+        if not patterns:
+            return
+        if HAVE_AHOCORASICK:
+            self.automaton = ahocorasick.Automaton()
+            for key in patterns:
+                self.automaton.add_word(key, key)
+            self.automaton.make_automaton()
+            return
+        # goto[node] maps a character to the next node, out[node] holds every key ending at that node
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for key in patterns:
+            node = 0
+            for ch in key:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[node][ch] = nxt
+                node = nxt
+            self.out[node].append(key)
+        # Breadth first so every failure link points at an already finished, shallower node
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                fail = self.fail[node]
+                while fail and ch not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[nxt] = self.goto[fail].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+        self.automaton = True
+
+    def find(self, text):
+        """Returns the set of keys that occur anywhere in text."""
+        found = set(self.always)
+        if self.automaton is None:
+            return found
+        if HAVE_AHOCORASICK:
+            found.update(key for _, key in self.automaton.iter(text))
+            return found
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+def get_args():
+    try:
+        parser = argparse.ArgumentParser(description="Retrieve one or more fastas from a given multifasta.",)
+        parser.add_argument("-f", "--fasta", action="store", required=True, help="The multifasta to search. May be BGZF compressed (bgzip).",)
+        parser.add_argument("-k", "--keyfile", action="store", help="A file of header strings to search the multifasta for. Must be one per line.",)
+        parser.add_argument("-s", "--string", action="store", help="Provide a string to look for directly, instead of a file (can accept a comma separated list of strings).",)
+        parser.add_argument("-o","--outfile", action="store", help="Output file to store the new fasta sequences in. Required unless --manifest is given.",)
+        parser.add_argument("-knf", "--keysnotfound", action="store", default="keys_not_found.txt", help="Output file to store the unfound header strings in. Useful for debugging.",)
+        parser.add_argument("-ti", "--tagindex", action="store", help="A locus tag index (<reference>_locus_tag_index.tsv from generate_unique_core_gene_tags.py). PEPPAN locus tags among the keys are translated to their old locus tags before searching.",)
+        parser.add_argument("-v", "--verbose", action="store_true", help="Set whether to print the key list out before the fasta sequences. Useful for debugging.",)
+        parser.add_argument("-i", "--invert", action="store_true", help="Invert the search, and retrieve all sequences NOT specified in the keyfile.",)
+        parser.add_argument("-m", "--method", action="store", choices=["exact", "partial"], default="exact", help="Search the headers as exact matches, or as partial substring matches.",)
+        parser.add_argument("-hc", "--hitcounts", action="store", help="Optional output file for the number of retrieved records each key matched (key<TAB>count).",)
+        parser.add_argument("-M", "--manifest", action="store", help="Batch mode: a tab separated file of jobs (keyfile, outfile, exact/partial, invert yes/no, optional keys-not-found file). The multifasta is read once and each record is routed to every job it matches.",)
+        parser.add_argument("--stream", action="store_true", help="Write records as soon as they are matched instead of holding them all in memory until the end.",)
+        parser.add_argument("--raw", action="store_true", help="Copy matched records byte for byte from the multifasta without decoding or rewrapping their sequences (line wrapping is kept as is). Implies --stream.",)
+        parser.add_argument("-b", "--buffer-size", action="store", type=int, default=1024 * 1024, help="Write buffer size in bytes for --stream and --raw (default: 1 MiB).",)
+        parser.add_argument("-t", "--threads", action="store", type=int, default=1, help="Number of worker processes (default: 1). Plain multifastas are split into byte ranges scanned in parallel, BGZF compressed ones are decompressed in parallel.",)
+        parser.add_argument("-x", "--index", action="store_true", help="Use an on-disk offset index (<fasta>.fetchidx) for exact lookups, building it if missing or out of date. Ignored for --invert and partial searches.",)
+        if len(sys.argv) == 1:
+            parser.print_help(sys.stderr)
+            sys.exit(1)
+
+    except NameError:
+        sys.stderr.write(
+            "An exception occured with argument parsing. Check your provided options."
+        )
+        sys.exit(1)
+
+    return parser.parse_args()
+
+def get_matched_keys(rec_id, description, method, key_set, matcher):
+    """Returns the keys a record matches: its ID for exact searches, or every key found in its header for partial ones."""
+    if method == "exact":
+        return [rec_id] if rec_id in key_set else []
+    # Every key found in the header, from a single pass over it
+    return matcher.find(description)
+
+def format_record(rec, raw):
+    """The text written out for a record: its bytes verbatim with --raw, otherwise as SeqIO would write it."""
+    return rec.raw if raw else rec.format_fasta()
+
+def output_record(rec, args):
+    """Turns a matched record into what gets written, printing it first with --verbose."""
+    out = format_record(rec, args.raw)
+    if args.verbose:
+        print(bytes(out).decode() if args.raw else out)
+    return out
+
+# Per worker process state for the sharded scan, set once by init_shard_worker
+_shard_state = {}
+# Largest byte range a shard covers, so the matched records a shard holds in memory stay bounded on large multifastas
+SHARD_SIZE = 64 * 1024 * 1024
+
+def init_shard_worker(fasta, keys, method, invert, raw):
+    """Builds the key set and matcher once per worker process rather than once per shard."""
+    _shard_state.update(
+        fasta=fasta,
+        method=method,
+        invert=invert,
+        raw=raw,
+        key_set=set(keys),
+        matcher=KeyMatcher(keys) if method == "partial" else None,
+    )
+
+def get_shards(fasta, count):
+    """Splits the multifasta into at least count byte ranges of at most SHARD_SIZE bytes.
+    A record belongs to the range its '>' falls in, so every record lands in exactly one shard."""
+    size = os.path.getsize(fasta)
+    count = max(count, -(-size // SHARD_SIZE))
+    step = max(-(-size // count), 1)
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+def scan_shard(byte_range):
+    """Matches the records starting in one byte range. Returns the formatted matched records, the found keys and the key hit counts."""
+    state = _shard_state
+    start, end = byte_range
+    matched = []
+    found_keys = []
+    key_hits = Counter()
+    for rec in iter_records(state["fasta"], start, end):
+        matched_keys = get_matched_keys(rec.id, rec.description, state["method"], state["key_set"], state["matcher"])
+        if bool(matched_keys) == state["invert"]:
+            continue
+        found_keys.extend([rec.id] if state["method"] == "exact" else matched_keys)
+        key_hits.update(matched_keys)
+        matched.append(bytes(rec.raw) if state["raw"] else rec.format_fasta())
+    return matched, found_keys, key_hits
+
+def iter_sharded_matches(args, keys, found_keys, key_hits):
+    """Scans byte range shards of the multifasta on args.threads processes and yields the matched records in file order.
+    Each shard reports its own found keys and hit counts, which are merged here so the totals are exact.
+    At most args.threads * 2 shards are in flight, so finished shards never pile up in memory ahead of the writer."""
+    shards = iter(get_shards(args.fasta, args.threads * 4))
+    with Pool(args.threads, initializer=init_shard_worker, initargs=(args.fasta, keys, args.method, args.invert, args.raw)) as pool:
+        pending = deque(pool.apply_async(scan_shard, (shard,)) for shard in islice(shards, args.threads * 2))
+        # Shards are collected in submission order, which is file order
+        while pending:
+            matched, shard_found_keys, shard_key_hits = pending.popleft().get()
+            for shard in islice(shards, 1):
+                pending.append(pool.apply_async(scan_shard, (shard,)))
+            found_keys.extend(shard_found_keys)
+            key_hits.update(shard_key_hits)
+            for out in matched:
+                if args.verbose:
+                    print(out.decode() if args.raw else out)
+                yield out
+
+def iter_matches(args, keys, found_keys, key_hits):
+    """Yields the records to write, one at a time. Only matched records ever have their sequence decoded.
+    found_keys and key_hits are filled in as the records are produced."""
+    if args.index and args.method == "exact" and args.invert is False:
+        # Only the requested records are read, so the cost scales with the keys rather than the multifasta
+        index = get_index(args.fasta, args.threads)
+        for rec in fetch_indexed(args.fasta, index, keys):
+            found_keys.append(rec.id)
+            key_hits[rec.id] += 1
+            yield output_record(rec, args)
+        return
+
+    if args.threads > 1 and not is_bgzf(args.fasta):
+        yield from iter_sharded_matches(args, keys, found_keys, key_hits)
+        return
+
+    key_set = set(keys)
+    matcher = KeyMatcher(keys) if args.method == "partial" else None
+    for rec in iter_records(args.fasta, threads=args.threads):
+        match_found = False
+        matched_keys = get_matched_keys(rec.id, rec.description, args.method, key_set, matcher)
+        if args.invert is False:
+            match_found = bool(matched_keys)
+        else:
+            match_found = not matched_keys
+        if match_found:
+            if args.method == "exact":
+                found_keys.append(rec.id)
+            else:
+                found_keys.extend(matched_keys)
+            key_hits.update(matched_keys)
+            yield output_record(rec, args)
+
+def run_batch(args):
+    """Runs every job in the manifest against a single pass over the multifasta, writing each job's output as records are routed to it."""
+    jobs = read_manifest(args.manifest)
+    tag_index = LocusTagIndex.load(args.tagindex) if args.tagindex else None
+    for job in jobs:
+        job["keys"] = read_keyfile(job["keyfile"])
+        if tag_index is not None:
+            job["keys"] = tag_index.to_old(job["keys"])
+        job["key_set"] = set(job["keys"])
+        job["matcher"] = KeyMatcher(job["keys"]) if job["method"] == "partial" else None
+        job["found_keys"] = set()
+        job["written"] = 0
+        job["out_fh"] = open(job["outfile"], "wb" if args.raw else "w", buffering=args.buffer_size)
+
+    try:
+        for rec in iter_records(args.fasta, threads=args.threads):
+            # Formatted at most once, however many jobs the record is routed to
+            formatted = None
+            for job in jobs:
+                matched_keys = get_matched_keys(rec.id, rec.description, job["method"], job["key_set"], job["matcher"])
+                if bool(matched_keys) == job["invert"]:
+                    continue
+                if formatted is None:
+                    formatted = format_record(rec, args.raw)
+                job["out_fh"].write(formatted)
+                job["written"] += 1
+                if job["method"] == "exact":
+                    job["found_keys"].add(rec.id)
+                else:
+                    job["found_keys"].update(matched_keys)
+    finally:
+        for job in jobs:
+            job["out_fh"].close()
+
+    for job in jobs:
+        unfound_keys = job["key_set"] - job["found_keys"]
+        print(f"{job['outfile']}: {job['written']} records written, {len(job['found_keys'])} matches found, {len(unfound_keys)} keys not found")
+        with open(job["keysnotfound"], "w") as unfound_fh:
+            for key in unfound_keys:
+                unfound_fh.write(f"{key}\n")
+
+def main():
+    """Takes a string or list of strings in a text file (one per line) and retreives them and their sequences from a provided multifasta."""
+    args = get_args()
+    if args.manifest:
+        run_batch(args)
+        return
+    if not args.outfile:
+        sys.stderr.write("No output file provided. Exiting.")
+        sys.exit(1)
+    # Call getKeys() to create the list of keys from the provided file:
+    if not (args.keyfile or args.string):
+        sys.stderr.write("No key source provided. Exiting.")
+        sys.exit(1)
+    if args.keyfile:
+        keys = get_keys(args)
+    else:
+        keys = args.string.split(",")
+    if args.tagindex:
+        keys = LocusTagIndex.load(args.tagindex).to_old(keys)
+
+    if args.verbose:
+        if args.invert is False:
+            sys.stderr.write("Fetching the following keys:\n")
+            for key in keys:
+                sys.stderr.write(key + "\n")
+        elif args.invert is True:
+            sys.stderr.write(
+                "Ignoring the following keys, and retreiving everything else from: {}\n".format(
+                    args.fasta
+                )
+            )
+            for key in keys:
+                sys.stderr.write(key + "\n")
+        sys.stderr.write(
+            "-" * 80 + "\n"
+        )
+
+    # found_keys is a list of keys that have matches when parsing the multifasta
+    found_keys = []
+    # key_hits counts how many retrieved records each key matched
+    key_hits = Counter()
+    records = iter_matches(args, keys, found_keys, key_hits)
+
+    if args.raw or args.stream:
+        with open(args.outfile, "wb" if args.raw else "w", buffering=args.buffer_size) as out_fh:
+            for record in records:
+                out_fh.write(record)
+    else:
+        to_write = list(records)
+
+    # number of found keys
+    found_count = len(set(found_keys))
+    # unfound_keys is a set of all not found keys when parsing the multifasta
+    unfound_keys = set(keys) - set(found_keys)
+    # number of unfound keys
+    unfound_count = len(unfound_keys)
+    
+    # Ensure summary is always printed
+    print(f"Number of matches found: {found_count}")
+    print(f"Number of keys not found: {unfound_count}")
+
+    if not (args.raw or args.stream):
+        with open(args.outfile, "w") as out_fh:
+            out_fh.writelines(to_write)
+
+    # Write unfound keys to unfound_keys.txt if there are more than one
+    if len(unfound_keys) > 1:
+        print(f'Found multiple keys not found in search, writing findings to {args.keysnotfound}...')
+        with open(args.keysnotfound, "w") as unfound_fh:
+            for key in unfound_keys:
+                unfound_fh.write(f"{key}\n")
+
+    if args.hitcounts:
+        with open(args.hitcounts, "w") as hits_fh:
+            for key in dict.fromkeys(keys):
+                hits_fh.write(f"{key}\t{key_hits[key]}\n")
+
+if __name__ == "__main__":
+    main()
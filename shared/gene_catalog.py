@@ -0,0 +1,225 @@
+# SQLite gene catalog shared by the pipeline scripts
+# instead of every script re-reading the same GFF, PIMMS, BLAST and presence matrix files, they are ingested once into indexed tables:
+#   genes          PEPPAN locus tags, ortholog groups, old locus tags and coordinates from PEPPAN.PEPPAN.gff files
+#   essentiality   PIMMS locus tags, feature types and insertion counts from the PIMMS output xlsx files
+#   blast_hits     BLAST outfmt 7 result rows, as blast_results.py reads them, with every field of the file's '# Fields:' header (listed in blast_fields)
+#   presence       presence matrix cells ($species_presence_matrix and no_results_all_species tables) in long form, with the query id of their row
+#   categories     gene category membership lists from gene_categoriser.R ($speciesname_core_peppan_gene_locuses.txt)
+# every file is recorded in the sources table with its size and modification time, a changed file is re-ingested the next time it is asked for
+# a catalog made with another SCHEMA_VERSION is emptied when it is opened, its files are re-ingested as they are asked for
+# generate_unique_core_gene_tags.py, essential_gene_extractor.py, blast_to_spreadsheet.py and merge2.py query the catalog with --catalog
+# usage: python shared/gene_catalog.py -c catalog.db gff PEPPAN.PEPPAN.gff   (kinds: gff, essentiality, blast, presence, categories)
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+
+# the repository root, so shared/ imports as a package when this file is run as a script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import blast_results, peppan_gff, table_io
+from shared.locus_tag_index import LocusTagIndex
+
+# Bumped whenever SCHEMA changes, stored as the database's user_version
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, kind TEXT NOT NULL, size INTEGER, mtime REAL);
+CREATE TABLE IF NOT EXISTS genes (source_id INTEGER, strain TEXT, peppan_tag TEXT, ortholog_group TEXT, old_locus_tag TEXT, seqid TEXT, start INTEGER, end INTEGER, strand TEXT);
+CREATE INDEX IF NOT EXISTS genes_strain ON genes (source_id, strain);
+CREATE INDEX IF NOT EXISTS genes_peppan_tag ON genes (peppan_tag);
+CREATE INDEX IF NOT EXISTS genes_old_locus_tag ON genes (old_locus_tag);
+CREATE INDEX IF NOT EXISTS genes_ortholog_group ON genes (ortholog_group);
+CREATE TABLE IF NOT EXISTS essentiality (source_id INTEGER, row INTEGER, locus_tag TEXT, type TEXT, insertions REAL);
+CREATE INDEX IF NOT EXISTS essentiality_source ON essentiality (source_id, insertions);
+CREATE INDEX IF NOT EXISTS essentiality_locus_tag ON essentiality (locus_tag);
+CREATE TABLE IF NOT EXISTS blast_fields (source_id INTEGER, run INTEGER, fields TEXT);
+CREATE TABLE IF NOT EXISTS blast_hits (source_id INTEGER, row INTEGER, run INTEGER, query TEXT, database TEXT, hits_found INTEGER, query_id TEXT, subject_id TEXT, evalue REAL, hit TEXT);
+CREATE INDEX IF NOT EXISTS blast_fields_source ON blast_fields (source_id, run);
+CREATE INDEX IF NOT EXISTS blast_hits_source ON blast_hits (source_id);
+CREATE INDEX IF NOT EXISTS blast_hits_query ON blast_hits (query);
+CREATE INDEX IF NOT EXISTS blast_hits_subject ON blast_hits (subject_id);
+CREATE TABLE IF NOT EXISTS presence (source_id INTEGER, row INTEGER, query TEXT, species TEXT, tag TEXT);
+CREATE INDEX IF NOT EXISTS presence_source ON presence (source_id);
+CREATE INDEX IF NOT EXISTS presence_tag ON presence (species, tag);
+CREATE TABLE IF NOT EXISTS categories (source_id INTEGER, row INTEGER, peppan_tag TEXT);
+CREATE INDEX IF NOT EXISTS categories_source ON categories (source_id);
+CREATE INDEX IF NOT EXISTS categories_peppan_tag ON categories (peppan_tag);
+"""
+
+TABLES = {"gff": "genes", "essentiality": "essentiality", "blast": "blast_hits", "presence": "presence", "categories": "categories"}
+
+def connect(catalog_file):
+    """Opens (creating if needed) a catalog. Parallel workers each open their own connection and wait for one another's writes."""
+    conn = sqlite3.connect(catalog_file, timeout=600)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        create_schema(conn)
+    return conn
+
+def create_schema(conn):
+    """Creates the tables of SCHEMA, dropping the tables of a catalog made with another SCHEMA_VERSION first."""
+    conn.execute("BEGIN IMMEDIATE")
+    # Another worker may have created them while this one waited for the lock
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall():
+            conn.execute(f'DROP TABLE "{name}"')
+        for statement in SCHEMA.split(";"):
+            if statement.strip():
+                conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+
+def to_db(value):
+    """pandas missing values (NaN, NA) become NULL and numpy scalars plain Python values."""
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+def iter_gff_rows(gff_file):
+    """Yields (strain, peppan_tag, ortholog_group, old_locus_tag, seqid, start, end, strand) for every PEPPAN locus tag in the GFF, in file order."""
+    with open(gff_file, 'r') as gff:
+        for line in gff:
+            # Comments, the ##FASTA section and lines without a peppan locus tag are skipped
+            parsed = peppan_gff.parse_line(line)
+            if parsed is None:
+                continue
+            strain, new_tags, ortholog_group, old_tag, seqid, start, end, strand = parsed
+            for new_tag in new_tags:
+                yield strain, new_tag, ortholog_group, old_tag, seqid, start, end, strand
+
+def ingest_gff(conn, source_id, gff_file):
+    conn.executemany("INSERT INTO genes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", ((source_id, *row) for row in iter_gff_rows(gff_file)))
+
+def ingest_essentiality(conn, source_id, pimms_file):
+    df = pd.read_excel(pimms_file)
+    rows = zip(df['locus_tag'], df['type'], df['test_num_insertions_mapped_per_feat'])
+    conn.executemany("INSERT INTO essentiality VALUES (?, ?, ?, ?, ?)",
+                     ((source_id, n, to_db(locus_tag), to_db(feature_type), to_db(insertions)) for n, (locus_tag, feature_type, insertions) in enumerate(rows)))
+
+def ingest_blast(conn, source_id, blast_file):
+    # The rows are parsed exactly as blast_to_spreadsheet.py parses them, one typed chunk at a time
+    # Consecutive chunks read with the same '# Fields:' header form a run, whose field names are stored once in blast_fields
+    row = 0
+    run = -1
+    run_fields = None
+    for df in blast_results.iter_blast_chunks(blast_file):
+        file_fields = list(df.columns[3:])
+        if file_fields != run_fields:
+            run += 1
+            run_fields = file_fields
+            conn.execute("INSERT INTO blast_fields VALUES (?, ?, ?)", (source_id, run, json.dumps(file_fields)))
+        # query id, subject id and evalue are copied to their own columns to be indexed and queried, the hit column holds every field
+        key_columns = [df[field] if field in df.columns else pd.Series(None, index=df.index, dtype=object) for field in ('query id', 'subject id', 'evalue')]
+        rows = zip(df['Query'], df['Database'], df['Hits found'], *key_columns, df[file_fields].itertuples(index=False))
+        conn.executemany("INSERT INTO blast_hits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         ((source_id, row + n, run, *map(to_db, values[:6]), json.dumps([to_db(value) for value in values[6]]))
+                          for n, values in enumerate(rows)))
+        row += len(df)
+
+def ingest_presence(conn, source_id, matrix_file):
+    df = table_io.read_presence_matrix(matrix_file)
+    # A table without query ids (no_results_all_species) has a RangeIndex, its rows get no query
+    queries = [None] * len(df) if isinstance(df.index, pd.RangeIndex) else df.index
+    conn.executemany("INSERT INTO presence VALUES (?, ?, ?, ?, ?)",
+                     ((source_id, n, to_db(query), str(species), to_db(tag))
+                      for n, (query, row) in enumerate(zip(queries, df.itertuples(index=False))) for species, tag in zip(df.columns, row)))
+
+def ingest_categories(conn, source_id, category_file):
+    with open(category_file, 'r') as categories:
+        # Same quote and newline stripping as generate_unique_core_gene_tags.py
+        conn.executemany("INSERT INTO categories VALUES (?, ?, ?)", ((source_id, n, line.strip('"\n')) for n, line in enumerate(categories)))
+
+INGESTERS = {"gff": ingest_gff, "essentiality": ingest_essentiality, "blast": ingest_blast, "presence": ingest_presence, "categories": ingest_categories}
+
+def get_source(conn, kind, file_path):
+    """Returns the source id of a file, ingesting it first if it is not in the catalog or has changed since it was ingested."""
+    file_path = os.path.realpath(file_path)
+    stat = os.stat(file_path)
+    found = conn.execute("SELECT id, kind, size, mtime FROM sources WHERE path = ?", (file_path,)).fetchone()
+    if found and found[1:] == (kind, stat.st_size, stat.st_mtime):
+        return found[0]
+    with conn:
+        if found:
+            conn.execute(f"DELETE FROM {TABLES[found[1]]} WHERE source_id = ?", (found[0],))
+            if found[1] == "blast":
+                conn.execute("DELETE FROM blast_fields WHERE source_id = ?", (found[0],))
+            conn.execute("DELETE FROM sources WHERE id = ?", (found[0],))
+        source_id = conn.execute("INSERT INTO sources (path, kind, size, mtime) VALUES (?, ?, ?, ?)", (file_path, kind, stat.st_size, stat.st_mtime)).lastrowid
+        INGESTERS[kind](conn, source_id, file_path)
+    return source_id
+
+def get_locus_tag_index(conn, gff_file, reference_strain_id):
+    """The LocusTagIndex of every line starting with reference_strain_id, as generate_unique_core_gene_tags.py builds it from the GFF."""
+    source_id = get_source(conn, "gff", gff_file)
+    index = LocusTagIndex()
+    # A range on the indexed strain column matches the same lines as line.startswith(reference_strain_id)
+    for new_tag, old_tag in conn.execute("SELECT peppan_tag, old_locus_tag FROM genes WHERE source_id = ? AND strain >= ? AND strain < ? ORDER BY rowid",
+                                         (source_id, reference_strain_id, reference_strain_id + "\U0010ffff")):
+        index.add(new_tag, old_tag)
+    return index
+
+def get_category_tags(conn, category_file):
+    """The lines of a gene category list, quotes and newlines stripped."""
+    source_id = get_source(conn, "categories", category_file)
+    return [tag for tag, in conn.execute("SELECT peppan_tag FROM categories WHERE source_id = ? ORDER BY row", (source_id,))]
+
+def get_essential_locus_tags(conn, pimms_file, cds):
+    """Locus tags with no insertions mapped, either of CDS features (cds=True) or of every other feature type, in spreadsheet order."""
+    source_id = get_source(conn, "essentiality", pimms_file)
+    type_filter = "type = 'CDS'" if cds else "(type IS NULL OR type != 'CDS')"
+    return [tag for tag, in conn.execute(f"SELECT locus_tag FROM essentiality WHERE source_id = ? AND insertions = 0 AND {type_filter} ORDER BY row", (source_id,))]
+
+def get_blast_results(conn, blast_file):
+    """The typed DataFrame blast_results.process_blast_results makes from a BLAST result file, read from the catalog."""
+    source_id = get_source(conn, "blast", blast_file)
+    run_fields = {run: json.loads(fields) for run, fields in conn.execute("SELECT run, fields FROM blast_fields WHERE source_id = ?", (source_id,))}
+    # One frame per run, so every run keeps the columns of its own '# Fields:' header, concatenated as process_blast_results concatenates its chunks
+    frames = []
+    run_rows = []
+    current_run = None
+    for run, query, database, hits_found, hit in conn.execute("SELECT run, query, database, hits_found, hit FROM blast_hits WHERE source_id = ? ORDER BY row", (source_id,)):
+        if run != current_run and run_rows:
+            frames.append(blast_results.make_blast_frame(run_rows, run_fields[current_run]))
+            run_rows = []
+        current_run = run
+        run_rows.append([query, database, hits_found] + json.loads(hit))
+    if run_rows:
+        frames.append(blast_results.make_blast_frame(run_rows, run_fields[current_run]))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+def get_presence_rows(conn, matrix_file, columns, origin=None):
+    """The rows of a presence matrix as tuples of the given columns, a column missing from the matrix giving pd.NA.
+    With origin, the origin species' empty cell of a row gets the row's query id, as merge2.read_matrix_rows does."""
+    source_id = get_source(conn, "presence", matrix_file)
+    rows = {}
+    queries = {}
+    for row, query, species, tag in conn.execute("SELECT row, query, species, tag FROM presence WHERE source_id = ? ORDER BY row", (source_id,)):
+        rows.setdefault(row, {})[species] = tag if tag is not None else float('nan')
+        queries[row] = query
+    if origin is not None:
+        for row, cells in rows.items():
+            if queries[row] is not None and pd.isna(cells.get(origin, pd.NA)):
+                cells[origin] = queries[row]
+    return [tuple(cells.get(col, pd.NA) for col in columns) for cells in rows.values()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest pipeline files into the SQLite gene catalog queried by the --catalog option of the pipeline scripts.")
+    parser.add_argument("-c", "--catalog", required=True, help="Path to the catalog database (created if missing).")
+    parser.add_argument("kind", choices=sorted(INGESTERS), help="gff: PEPPAN.PEPPAN.gff, essentiality: PIMMS output xlsx, blast: BLAST outfmt 7 .txt, presence: presence matrix xlsx, categories: *_core_peppan_gene_locuses.txt")
+    parser.add_argument("files", nargs="+", help="Files to ingest. Files already in the catalog are only re-ingested if they have changed.")
+    args = parser.parse_args()
+
+    conn = connect(args.catalog)
+    for file_path in args.files:
+        source_id = get_source(conn, args.kind, file_path)
+        count = conn.execute(f"SELECT COUNT(*) FROM {TABLES[args.kind]} WHERE source_id = ?", (source_id,)).fetchone()[0]
+        print(f"{file_path}: {count} {TABLES[args.kind]} rows in {args.catalog}")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# bidirectional PEPPAN locus tag <-> old locus tag index, built by generate_unique_core_gene_tags.py from PEPPAN.PEPPAN.gff
+# saved as a two column .tsv (peppan tag, old locus tag) so later runs and other scripts can load it instead of re-reading the GFF
+# used by pancat_parser.py, fastafetcher_V2.py and blast_recap_generator.py to translate locus tags
+
+import os
+from collections import defaultdict
+
+class LocusTagIndex:
+    """PEPPAN (new) locus tags mapped to old locus tags and back, with O(1) lookups both ways.
+    A PEPPAN tag has at most one old tag (a later add replaces it, None meaning no old_locus_tag),
+    while one old tag can collect several PEPPAN tags; those many-to-one collisions are reported by collisions()."""
+
+    def __init__(self):
+        self.old_by_new = {}
+        self.new_by_old = defaultdict(list)
+
+    def add(self, new_tag, old_tag):
+        """Maps a PEPPAN tag to an old tag (or None), replacing any previous mapping of that PEPPAN tag."""
+        previous = self.old_by_new.get(new_tag)
+        if new_tag in self.old_by_new and previous == old_tag:
+            return
+        if previous is not None:
+            self.new_by_old[previous].remove(new_tag)
+            if not self.new_by_old[previous]:
+                del self.new_by_old[previous]
+        self.old_by_new[new_tag] = old_tag
+        if old_tag is not None:
+            self.new_by_old[old_tag].append(new_tag)
+
+    def __len__(self):
+        return len(self.old_by_new)
+
+    def __contains__(self, new_tag):
+        return new_tag in self.old_by_new
+
+    def old_tag(self, new_tag):
+        """The old locus tag of a PEPPAN tag, or None."""
+        return self.old_by_new.get(new_tag)
+
+    def new_tags(self, old_tag):
+        """Every PEPPAN tag mapped to an old locus tag, in the order they were added."""
+        return list(self.new_by_old.get(old_tag, []))
+
+    def collisions(self):
+        """Old locus tags that more than one PEPPAN tag maps to: {old_tag: [new_tag, ...]}."""
+        return {old_tag: list(new_tags) for old_tag, new_tags in self.new_by_old.items() if len(new_tags) > 1}
+
+    def to_old(self, tags):
+        """Translates PEPPAN tags to old locus tags. Tags without an old locus tag are passed through unchanged."""
+        return [self.old_by_new.get(tag) or tag for tag in tags]
+
+    def to_new(self, tags):
+        """Translates old locus tags to every PEPPAN tag they map to. Tags not in the index are passed through unchanged."""
+        translated = []
+        for tag in tags:
+            translated.extend(self.new_by_old.get(tag) or [tag])
+        return translated
+
+    def save(self, index_file):
+        """Writes the index as peppan_tag<TAB>old_locus_tag lines, the old tag left empty when there is none.
+        The file is written under a temporary name and renamed, so a process loading it never sees it half written.
+        On OSError the temporary file is removed before the error is raised."""
+        temp_file = f"{index_file}.{os.getpid()}.tmp"
+        try:
+            with open(temp_file, "w") as ifh:
+                for new_tag, old_tag in self.old_by_new.items():
+                    ifh.write(f"{new_tag}\t{old_tag or ''}\n")
+            os.replace(temp_file, index_file)
+        except OSError:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    @classmethod
+    def load(cls, index_file):
+        """Reads an index written by save()."""
+        index = cls()
+        with open(index_file, "r") as ifh:
+            for line in ifh:
+                new_tag, _, old_tag = line.rstrip("\n").partition("\t")
+                index.add(new_tag, old_tag or None)
+        return index
+
+    @classmethod
+    def load_if_fresh(cls, index_file, source_file):
+        """Loads a cached index only if it is at least as new as the file it was built from, otherwise returns None."""
+        if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(source_file):
+            return cls.load(index_file)
+        return None
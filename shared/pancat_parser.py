@@ -0,0 +1,133 @@
+# inputs for this are a .txt line seperated keyfile of locus tags and a the ALLELE.fna output file from a PEPPAN run
+# outputs are a multifasta with the sequences for each line in the keyfile that a match was found for
+# this script was used to generate multiFASTA files for all the Core/Shell/Cloud genes for each species or intersection of species (chapters 2 and 3)
+
+from bisect import bisect_left
+import os
+import re
+import sys
+import argparse
+# the repository root, so shared/ imports as a package when this file is run as a script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared.fasta_reader import iter_records, read_records_at
+from shared.locus_tag_index import LocusTagIndex
+
+# Alleles whose header ends their first word with `_1` are preferred as the best match
+BEST_SUFFIX_RE = re.compile(r"_1(\s|$)")
+
+def load_keys(keyfile):
+    """Load locus tags from the keyfile."""
+    with open(keyfile, "r") as kf:
+        return [line.strip() for line in kf if line.strip()]
+
+def get_locus_tag(header):
+    """Extract the locus tag from an allele header, or None for a malformed header."""
+    parts = header.split(":")
+    if len(parts) < 2:
+        return None
+    return parts[1].split()[0]
+
+def parse_fasta(fasta_file, threads=1):
+    """Parse the allele fasta file and return a dictionary of sequences by locus tag.
+    Records stay as slices of the mapped file until they are written."""
+    sequences = {}
+    for record in iter_records(fasta_file, threads=threads):
+        header = record.description  # Full header
+        locus_tag = get_locus_tag(header)
+        if locus_tag is None:
+            continue  # Skip malformed headers
+        sequences[header] = (locus_tag, record)
+    return sequences
+
+def scan_headers(fasta_file, keys, threads=1):
+    """Header-only first pass: returns a dictionary of header -> (locus tag, (byte offset, length)) without reading any sequence.
+    Only alleles whose locus tag starts with one of the keys are kept, so memory scales with the keys rather than the allele file."""
+    key_set = set(keys)
+    key_lengths = sorted({len(key) for key in key_set})
+    locations = {}
+    for record in iter_records(fasta_file, threads=threads):
+        header = record.description
+        locus_tag = get_locus_tag(header)
+        if locus_tag is None:
+            continue  # Skip malformed headers
+        if any(locus_tag[:length] in key_set for length in key_lengths if length <= len(locus_tag)):
+            locations[header] = (locus_tag, (record.offset, record.length))
+    return locations
+
+def read_sequences(fasta_file, best_locations):
+    """Second pass: reads back only the chosen records, in file order, and returns them keyed by header in the original order."""
+    ordered = sorted(best_locations.items(), key=lambda item: item[1])
+    records = dict(zip((header for header, location in ordered), read_records_at(fasta_file, (location for header, location in ordered))))
+    return {header: records[header] for header in best_locations}
+
+def build_prefix_index(sequences):
+    """Sorts the alleles by locus tag once, so the alleles starting with a key form one contiguous range found by binary search.
+    Each allele's rank (no `_1` suffix, header length, file order) is precomputed so picking the best match is a plain min()."""
+    entries = sorted(
+        (locus, (not BEST_SUFFIX_RE.search(header), len(header), order), header)
+        for order, (header, (locus, seq)) in enumerate(sequences.items())
+    )
+    tags = [locus for locus, rank, header in entries]
+    ranks = [(rank, header) for locus, rank, header in entries]
+    return tags, ranks
+
+def filter_best_matches(keys, sequences):
+    """Filter sequences to retain the best match based on criteria."""
+    best_matches = {}
+    keys_with_matches = set()
+    tags, ranks = build_prefix_index(sequences)
+
+    for key in keys:
+        # Every locus tag starting with key sorts between key and key followed by the highest code point
+        start = bisect_left(tags, key)
+        end = bisect_left(tags, key + "\U0010ffff", start)
+
+        if start == end:
+            continue  # No match found
+
+        keys_with_matches.add(key)
+        # Prioritize `_1` suffix, then shortest header, then the first seen in the fasta
+        rank, best_header = min(ranks[start:end])
+        best_matches[best_header] = sequences[best_header][1]
+
+    return best_matches, keys_with_matches
+
+def write_fasta(output_file, best_matches):
+    """Write filtered sequences to a multifasta file."""
+    with open(output_file, "w") as out_f:
+        for record in best_matches.values():
+            out_f.write(record.format_fasta())
+
+def main():
+    parser = argparse.ArgumentParser(description="Filter FASTA sequences based on keyfile.")
+    parser.add_argument("-k", "--keyfile", required=True, help="Path to keyfile.")
+    parser.add_argument("-f", "--fasta", required=True, help="Path to input FASTA file. May be BGZF compressed (bgzip).")
+    parser.add_argument("-o", "--output", required=True, help="Path to output FASTA file.")
+    parser.add_argument("--lazy", action="store_true", help="Scan headers only on a first pass and read back just the best matching sequences, keeping memory proportional to the keys.")
+    parser.add_argument("-t", "--threads", type=int, default=1, help="Number of processes used to decompress a BGZF compressed FASTA file (default: 1).")
+    parser.add_argument("--tagindex", help="A locus tag index (<reference>_locus_tag_index.tsv from generate_unique_core_gene_tags.py). Old locus tags in the keyfile are translated to their PEPPAN locus tags first.")
+    args = parser.parse_args()
+    
+    keys = load_keys(args.keyfile)
+    if args.tagindex:
+        keys = LocusTagIndex.load(args.tagindex).to_new(keys)
+    if args.lazy:
+        locations = scan_headers(args.fasta, keys, args.threads)
+        best_locations, keys_with_matches = filter_best_matches(keys, locations)
+        best_matches = read_sequences(args.fasta, best_locations)
+    else:
+        sequences = parse_fasta(args.fasta, args.threads)
+        best_matches, keys_with_matches = filter_best_matches(keys, sequences)
+    write_fasta(args.output, best_matches)
+    
+    total_keys = len(keys)
+    matched_keys = len(keys_with_matches)
+    unmatched_keys = total_keys - matched_keys
+    
+    print(f"Filtered FASTA saved to {args.output} with {len(best_matches)} sequences.")
+    print(f"Keys with matches: {matched_keys}")
+    print(f"Keys without matches: {unmatched_keys}")
+
+if __name__ == "__main__":
+    main()
+
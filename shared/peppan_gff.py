@@ -0,0 +1,43 @@
+# parsing of PEPPAN.PEPPAN.gff lines, shared by every script that reads the PEPPAN GFF
+# a line's ortholog_group attribute lists the PEPPAN locus tags of the line as GCF_<assembly>:<tag>:<...> entries separated by commas,
+# and its old_locus_tag attribute (when there is one) is the reference annotation's locus tag
+# used by generate_unique_core_gene_tags.py, peppan_gff_to_parquet.py and gene_catalog.py
+
+import re
+
+# Patterns are compiled once and each GFF line is only parsed once
+OLD_LOCUS_TAG_RE = re.compile(r"old_locus_tag=([^;\n:]+)")
+ORTHOLOG_GROUP_RE = re.compile(r"ortholog_group:([^;]+)")
+NEW_TAG_RE = re.compile(r":([^:]+):")
+
+def split_ortholog_group(ortholog_group):
+    """The PEPPAN locus tags (the "RS tags") of an ortholog_group attribute value, in order."""
+    # Split the content by ',GCF_' to handle multiple entries, prepending 'GCF_' to each split part except the first one to restore the cut-off part
+    entries = ['GCF_' + entry if i != 0 else entry for i, entry in enumerate(ortholog_group.split(',GCF_'))]
+    return [match.group(1) for match in map(NEW_TAG_RE.search, entries) if match]
+
+def parse_attributes(text):
+    """Parses the attributes of a GFF line (or the whole line) into (ortholog_group, new_tags, old_tag).
+    Returns None when there is no ortholog_group, old_tag is None when there is no old_locus_tag."""
+    ortholog_group_content = ORTHOLOG_GROUP_RE.search(text)
+    if not ortholog_group_content:
+        return None
+    ortholog_group = ortholog_group_content.group(1)
+    old_tag_match = OLD_LOCUS_TAG_RE.search(text)
+    return ortholog_group, split_ortholog_group(ortholog_group), old_tag_match.group(1) if old_tag_match else None
+
+def parse_line(line):
+    """Parses a GFF feature line into (strain, new_tags, ortholog_group, old_tag, seqid, start, end, strand).
+    Returns None for comments, the ##FASTA section and lines without a peppan locus tag."""
+    if "ortholog_group:" not in line or line.startswith("#"):
+        return None
+    fields = line.rstrip("\n").split("\t")
+    if len(fields) < 9:
+        return None
+    attributes = parse_attributes(fields[8])
+    if attributes is None:
+        return None
+    ortholog_group, new_tags, old_tag = attributes
+    # The seqid column is <strain>:<contig>
+    strain, _, seqid = fields[0].partition(":")
+    return strain, new_tags, ortholog_group, old_tag, seqid, int(fields[3]), int(fields[4]), fields[6]
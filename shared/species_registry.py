@@ -0,0 +1,40 @@
+# loader for species_registry.json (in the repository root), the one list of species every per-species script runs over
+# each species has a short key (used in file names and presence matrix columns), a display name, the species folder name and its reference strain ID
+# "pangenomes" are extra folders (e.g. All) that generate_unique_core_gene_tags.py maps against a reference strain, but that are not a species column
+# to run on other species, copy species_registry.json, edit it and pass it with -r/--registry
+
+import json
+import os
+
+DEFAULT_REGISTRY = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "species_registry.json")
+
+def add_registry_argument(parser):
+    """Adds the -r/--registry option shared by every script reading the registry."""
+    parser.add_argument("-r", "--registry", default=DEFAULT_REGISTRY, help="Path to the species registry .json (default: species_registry.json in the repository root).")
+
+def load_registry(registry_file=None):
+    """Reads the registry, checking that every species has the fields the scripts rely on."""
+    with open(registry_file or DEFAULT_REGISTRY, 'r') as fh:
+        registry = json.load(fh)
+    for species in registry.get("species", []):
+        missing = [field for field in ("key", "name", "folder", "reference_strain_id") if field not in species]
+        if missing:
+            raise ValueError(f"Species {species} in {registry_file or DEFAULT_REGISTRY} is missing {', '.join(missing)}")
+    registry.setdefault("pangenomes", [])
+    return registry
+
+def get_species_keys(registry):
+    """Short species keys in registry order, e.g. ['equi', 'iniae', ...]."""
+    return [species["key"] for species in registry["species"]]
+
+def get_species_names(registry):
+    """{display name: key}, e.g. {'S.Equi_sb_equi': 'equi'}."""
+    return {species["name"]: species["key"] for species in registry["species"]}
+
+def get_reference_strain_ids(registry):
+    """{folder: reference strain ID} for every species folder, then every pangenome folder."""
+    return {entry["folder"]: entry["reference_strain_id"] for entry in registry["species"] + registry["pangenomes"]}
+
+def get_workers(requested, jobs):
+    """Process count for a per-species fan out: the requested count, or one per CPU, never more than there are jobs."""
+    return max(1, min(requested or os.cpu_count() or 1, jobs))
@@ -0,0 +1,134 @@
+# reading and writing the tables passed between the chapter3 scripts (blast_to_spreadsheet.py -> blast_spreadsheet_combiner.py -> generate_all_presence_matrices_V2.py -> merge2.py -> generate_upset_input.py / essential_all_extractor.py)
+# tables are written as Parquet by default, or Feather; Excel (.xlsx) is only an optional export for looking at results
+# presence matrices are stored either wide (one row per query, one column per target species) or as long-form pairs tables holding only the present cells
+# the format of a file follows its extension, and reading a Parquet/Feather table only loads the columns and rows asked for (column projection and predicate pushdown)
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# optional deps (graceful fallback)
+try:
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    HAVE_PYARROW = True
+except Exception:
+    HAVE_PYARROW = False
+
+FORMATS = ["parquet", "feather", "xlsx"]
+EXTENSIONS = {".parquet": "parquet", ".pq": "parquet", ".feather": "feather", ".arrow": "feather", ".xlsx": "xlsx", ".xls": "xlsx"}
+# Columns of the long-form (sparse) presence tables, one row per present cell of a presence matrix
+PAIRS_COLUMNS = ["query id", "target", "subject id"]
+# Operators accepted in filters, as in pandas.read_parquet(filters=...)
+OPERATORS = {
+    "==": lambda column, value: column == value,
+    "=": lambda column, value: column == value,
+    "!=": lambda column, value: column != value,
+    "<": lambda column, value: column < value,
+    "<=": lambda column, value: column <= value,
+    ">": lambda column, value: column > value,
+    ">=": lambda column, value: column >= value,
+    "in": lambda column, value: column.isin(value),
+    "not in": lambda column, value: ~column.isin(value),
+}
+
+def add_format_argument(parser, default="parquet"):
+    """Adds the --format option shared by the scripts writing tables."""
+    parser.add_argument("--format", choices=FORMATS, default=default, help=f"Format of the output tables (default: {default}). parquet and feather are fast columnar formats, xlsx is for opening the results in Excel.")
+
+def get_output_format(requested):
+    """The requested format, or xlsx when pyarrow is not installed to write Parquet/Feather."""
+    if requested != "xlsx" and not HAVE_PYARROW:
+        sys.stderr.write(f"pyarrow is not installed, writing xlsx instead of {requested}.\n")
+        return "xlsx"
+    return requested
+
+def get_format(path):
+    """The table format of a file, from its extension."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXTENSIONS:
+        raise ValueError(f"{path} is not a table file, expected one of {', '.join(EXTENSIONS)}")
+    return EXTENSIONS[ext]
+
+def find_table(stem):
+    """The newest of stem.parquet, stem.feather and stem.xlsx, or None when none exists.
+    A table rewritten in another format leaves the old file behind, so the most recently written one is the current one."""
+    paths = [f"{stem}.{table_format}" for table_format in FORMATS if os.path.exists(f"{stem}.{table_format}")]
+    return max(paths, key=os.path.getmtime) if paths else None
+
+def get_pandas_index_columns(dataset):
+    """The columns a Parquet file stores its pandas index in (none for a RangeIndex, which is kept in the metadata only)."""
+    return [column for column in (dataset.schema.pandas_metadata or {}).get("index_columns", []) if isinstance(column, str)]
+
+def get_columns(path):
+    """Column names of a table, read from the Parquet/Feather schema or the Excel header row only."""
+    table_format = get_format(path)
+    if table_format == "xlsx":
+        return [str(column) for column in pd.read_excel(path, nrows=0).columns]
+    dataset = ds.dataset(path, format=table_format)
+    # The pandas index of a Parquet file is stored as a column, it is not a data column
+    index_columns = get_pandas_index_columns(dataset)
+    return [name for name in dataset.schema.names if name not in index_columns]
+
+def get_index_column(path):
+    """The column holding the index of a table written by write_table(index=True), or None: the pandas index column of a Parquet file,
+    the "index" column Feather gets from reset_index(), or the unnamed first column of an Excel sheet."""
+    table_format = get_format(path)
+    if table_format == "xlsx":
+        columns = get_columns(path)
+        return columns[0] if columns and columns[0].startswith("Unnamed: 0") else None
+    dataset = ds.dataset(path, format=table_format)
+    index_columns = get_pandas_index_columns(dataset)
+    if index_columns:
+        return index_columns[0]
+    return "index" if "index" in dataset.schema.names else None
+
+def read_table(path, columns=None, filters=None):
+    """Reads a table into a DataFrame. columns limits the columns read, filters ([(column, operator, value), ...], all must hold)
+    limits the rows; for Parquet/Feather both are pushed down to the reader, so skipped columns and row groups are never decoded."""
+    table_format = get_format(path)
+    if table_format == "xlsx":
+        df = pd.read_excel(path)
+        for column, operator, value in filters or []:
+            df = df[OPERATORS[operator](df[column], value)]
+        return df[columns] if columns is not None else df
+    dataset = ds.dataset(path, format=table_format)
+    # Columns used only by the filters do not need to be read
+    table = dataset.to_table(columns=columns, filter=pq.filters_to_expression(filters) if filters else None)
+    return table.to_pandas()
+
+def write_table(df, path, index=False):
+    """Writes a DataFrame in the format given by the file extension."""
+    table_format = get_format(path)
+    if table_format == "parquet":
+        df.to_parquet(path, index=index)
+    elif table_format == "feather":
+        # Feather cannot store a pandas index, so it is written as a column
+        (df.reset_index() if index else df.reset_index(drop=True)).to_feather(path)
+    else:
+        df.to_excel(path, index=index)
+
+def pairs_to_matrix(pairs):
+    """Builds a presence matrix in one step from a long-form table of query id, target and subject id: one row per query (sorted, as the index),
+    one column per target (sorted), NaN where a query has no match. Queries and targets are encoded as integers and the cells set in a single assignment."""
+    query_codes, queries = pd.factorize(pairs["query id"].astype(object), sort=True)
+    target_codes, targets = pd.factorize(pairs["target"].astype(object), sort=True)
+    cells = np.full((len(queries), len(targets)), np.nan, dtype=object)
+    cells[query_codes, target_codes] = pairs["subject id"].to_numpy(dtype=object)
+    return pd.DataFrame(cells, index=pd.Index(queries), columns=pd.Index(targets))
+
+def read_presence_matrix(path, columns=None):
+    """Reads a presence matrix stored wide or as a long-form pairs table, indexed by the origin species' query ids in either case
+    (a RangeIndex for a table without them, such as no_results_all_species). columns limits the target columns read, those the matrix does not have are left out."""
+    available = get_columns(path)
+    if not set(PAIRS_COLUMNS) <= set(available):
+        index_column = get_index_column(path)
+        read_columns = [column for column in columns if column in available and column != index_column] if columns is not None else None
+        df = read_table(path, columns=[index_column] + read_columns if index_column and read_columns is not None else read_columns)
+        if index_column in df.columns:
+            df = df.set_index(index_column)
+        return df.rename_axis(None)
+    matrix = pairs_to_matrix(read_table(path, columns=PAIRS_COLUMNS))
+    return matrix[[column for column in columns if column in matrix.columns]] if columns is not None else matrix